@@ -1,7 +1,12 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
 import os
+from db_pool import InstrumentedAsyncQueuePool, InstrumentedQueuePool, pool_options
+from metrics import instrument_engine
+from tracing import trace_engine
 
 # Read DB configuration from environment variables (set by docker-compose)
 MYSQL_USER = os.getenv("DB_USER", "root")
@@ -10,18 +15,91 @@ MYSQL_PASSWORD = os.getenv("DB_PASSWORD", "root")
 MYSQL_HOST = os.getenv("DB_HOST", os.getenv("MYSQL_HOST", "mysql"))
 MYSQL_PORT = os.getenv("DB_PORT", os.getenv("MYSQL_TCP_PORT", "3306"))
 MYSQL_DB = os.getenv("DB_NAME", "tasks_db")
+# sync: pymysql, each query runs in the threadpool; async: aiomysql on the event loop
+DB_MODE = os.getenv("DB_MODE", "sync")
 
 DATABASE_URL = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
+ASYNC_DATABASE_URL = f"mysql+aiomysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
 
 # Configure SQLAlchemy engine and session
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, poolclass=InstrumentedQueuePool, **pool_options())
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrument_engine(engine)
+trace_engine(engine)
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# The async engine is only created when selected; table creation always uses the sync one
+if DB_MODE == "async":
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=InstrumentedAsyncQueuePool, **pool_options())
+    instrument_engine(async_engine.sync_engine)
+    trace_engine(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+elif DB_MODE != "sync":
+    raise ValueError(f"DB_MODE must be 'sync' or 'async', got {DB_MODE!r}")
+
+
+def pool_status() -> dict:
+    """Pool metrics for every engine this process uses."""
+    status = {"sync": InstrumentedQueuePool.metrics.snapshot(engine.pool)}
+    if DB_MODE == "async":
+        status["async"] = InstrumentedAsyncQueuePool.metrics.snapshot(async_engine.sync_engine.pool)
+    return status
+
+
+class SyncSessionAdapter:
+    """AsyncSession-compatible wrapper over a sync Session.
+
+    Lets the async routers run unchanged in sync mode: every call that talks
+    to the database is handed to the threadpool.
+    """
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, params=None):
+        return await run_in_threadpool(self.sync_session.execute, statement, params)
+
+    async def scalar(self, statement, params=None):
+        return await run_in_threadpool(self.sync_session.scalar, statement, params)
+
+    async def get(self, entity, ident):
+        return await run_in_threadpool(self.sync_session.get, entity, ident)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def refresh(self, instance):
+        await run_in_threadpool(self.sync_session.refresh, instance)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+async def get_db():
+    if DB_MODE == "async":
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        # Same as the async sessions: attributes stay loaded after commit, so
+        # reading them never issues a blocking lazy load on the event loop
+        db = SyncSessionAdapter(SessionLocal(expire_on_commit=False))
+        try:
+            yield db
+        finally:
+            await db.close()
@@ -0,0 +1,123 @@
+"""Connection pool settings and metrics for the SQLAlchemy engines.
+
+Pool sizing comes from the DB_POOL_* environment variables. Both engines use
+instrumented pool classes that time every checkout, so /metrics/db-pool can
+report checked-out connections, overflow in use, timeouts and a histogram of
+how long requests waited for a connection. The same wait histogram, timeouts
+and occupancy are exported to Prometheus, labelled by pool (sync or async).
+"""
+import bisect
+import os
+import threading
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from metrics import Counter, Gauge, Histogram
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+# Recycle before MySQL's wait_timeout closes idle connections on the server side
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+
+# Upper bounds in seconds; the last bucket is +Inf
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+POOL_WAIT_SECONDS = Histogram("db_pool_wait_seconds", "Time waiting to check out a pooled connection", ("pool",),
+                              buckets=WAIT_BUCKETS)
+POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT", ("pool",))
+
+
+class PoolMetrics:
+    def __init__(self, name: str):
+        self.name = name
+        # The engine's current pool, set when it is created (or recreated)
+        self.pool = None
+        self._lock = threading.Lock()
+        self._buckets = [0] * (len(WAIT_BUCKETS) + 1)
+        self._wait_sum = 0.0
+        self._checkouts = 0
+        self._timeouts = 0
+
+    def observe_wait(self, seconds: float):
+        with self._lock:
+            self._buckets[bisect.bisect_left(WAIT_BUCKETS, seconds)] += 1
+            self._wait_sum += seconds
+            self._checkouts += 1
+        POOL_WAIT_SECONDS.observe(seconds, self.name)
+
+    def observe_timeout(self):
+        with self._lock:
+            self._timeouts += 1
+        POOL_TIMEOUTS.inc(self.name)
+
+    def snapshot(self, pool) -> dict:
+        with self._lock:
+            buckets = {str(bound): count for bound, count in zip(WAIT_BUCKETS, self._buckets)}
+            buckets['+Inf'] = self._buckets[-1]
+            return {
+                'pool_size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'idle': pool.checkedin(),
+                # negative while the pool has not opened pool_size connections yet
+                'overflow': max(pool.overflow(), 0),
+                'max_overflow': pool._max_overflow,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'wait_seconds_sum': round(self._wait_sum, 6),
+                'wait_seconds_buckets': buckets,
+            }
+
+
+class _InstrumentedPoolMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics.pool = self
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.observe_timeout()
+            raise
+        self.metrics.observe_wait(time.perf_counter() - start)
+        return conn
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    metrics = PoolMetrics("sync")
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    metrics = PoolMetrics("async")
+
+
+def _pool_gauge(read):
+    def collect():
+        return {
+            (metrics.name,): read(metrics.pool)
+            for metrics in (InstrumentedQueuePool.metrics, InstrumentedAsyncQueuePool.metrics)
+            if metrics.pool is not None
+        }
+    return collect
+
+
+Gauge("db_pool_checked_out", "Connections checked out of the pool", ("pool",),
+      collect=_pool_gauge(lambda pool: pool.checkedout()))
+Gauge("db_pool_max_connections", "pool_size + max_overflow", ("pool",),
+      collect=_pool_gauge(lambda pool: pool.size() + pool._max_overflow))
+
+
+def pool_options() -> dict:
+    """Keyword arguments shared by create_engine and create_async_engine."""
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
@@ -0,0 +1,130 @@
+"""Password hashing in a dedicated, size-limited process pool.
+
+pbkdf2_sha256 is deliberately slow and holds the GIL, so running it in the
+request worker stalls every other request on it. Here it runs in
+HASH_POOL_WORKERS separate processes. At most HASH_QUEUE_LIMIT operations may
+be running or waiting; beyond that callers get 503 with Retry-After instead of
+piling up behind a login burst.
+
+Latency (including the wait for a free worker), rejections and pending
+operations are served as JSON at /metrics/hashing and exported to Prometheus
+as password_hash_duration_seconds, password_hash_rejected_total and
+password_hash_pending.
+"""
+import asyncio
+import bisect
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from metrics import Counter, Gauge, Histogram
+from tracing import tracer
+
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", str(os.cpu_count() or 1)))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", str(HASH_POOL_WORKERS * 8)))
+HASH_RETRY_AFTER = int(os.getenv("HASH_RETRY_AFTER", "1"))
+
+# Upper bounds in seconds; the last bucket is +Inf
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HASH_SECONDS = Histogram("password_hash_duration_seconds", "Hash or verify time, waiting for a worker included",
+                         ("op",), buckets=LATENCY_BUCKETS)
+HASH_REJECTED = Counter("password_hash_rejected_total", "Operations refused with 503 because the queue was full")
+
+pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+
+
+# Module-level so the pool can pickle them
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed: str) -> bool:
+    return pwd_context.verify(password, hashed)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self._buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self._buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def snapshot(self) -> dict:
+        buckets = {str(bound): count for bound, count in zip(LATENCY_BUCKETS, self._buckets)}
+        buckets["+Inf"] = self._buckets[-1]
+        return {"count": self.count, "seconds_sum": round(self.sum, 6), "seconds_buckets": buckets}
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = HASH_POOL_WORKERS, queue_limit: int = HASH_QUEUE_LIMIT):
+        self._workers = workers
+        self._queue_limit = queue_limit
+        self._executor: ProcessPoolExecutor | None = None
+        # Only touched from the event loop, so no lock is needed
+        self._pending = 0
+        self.rejected = 0
+        self.latency = {"hash": LatencyHistogram(), "verify": LatencyHistogram()}
+
+    def start(self):
+        if self._executor is None:
+            # spawn: the workers must not inherit the server's threads and sockets
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, op: str, fn, *args):
+        if self._pending >= self._queue_limit:
+            self.rejected += 1
+            HASH_REJECTED.inc()
+            raise HTTPException(
+                status_code=503,
+                detail="Password hashing is overloaded, retry later",
+                headers={"Retry-After": str(HASH_RETRY_AFTER)},
+            )
+        self.start()
+        self._pending += 1
+        start = time.perf_counter()
+        try:
+            # The span includes the wait for a free worker, like the latency histogram
+            with tracer.span(f"password.{op}"):
+                return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+            elapsed = time.perf_counter() - start
+            self.latency[op].observe(elapsed)
+            HASH_SECONDS.observe(elapsed, op)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run("verify", _verify, password, hashed)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self._workers,
+            "queue_limit": self._queue_limit,
+            "pending": self._pending,
+            "rejected": self.rejected,
+            "latency": {op: histogram.snapshot() for op, histogram in self.latency.items()},
+        }
+
+
+hasher = PasswordHasher()
+
+Gauge("password_hash_pending", "Hash operations running or waiting for a worker",
+      collect=lambda: {(): hasher.stats()["pending"]})
@@ -1,6 +1,10 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from metrics import CONTENT_TYPE, MetricsMiddleware, render
+from tracing import TracingMiddleware, tracer
 from routers import auth
-from database import Base, engine
+from database import Base, engine, pool_status
+from hashing import hasher
 from sqlalchemy import inspect, text
 import logging
 
@@ -9,6 +13,8 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Auth Service")
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 
 # Crear tablas si no existen y asegurar columna role
 def ensure_role_column():
@@ -25,11 +31,38 @@ ensure_role_column()
 app.include_router(auth.router)
 
 @app.get("/health")
-def health():
+async def health():
     """Health check endpoint for Kubernetes"""
     return {"status": "healthy", "service": "auth-service"}
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Request, database and threadpool metrics in Prometheus text format"""
+    return PlainTextResponse(render(), media_type=CONTENT_TYPE)
+
+@app.get("/metrics/tracing")
+async def tracing_metrics():
+    """Spans exported, dropped on a full queue and lost to exporter errors"""
+    return tracer.stats()
+
+@app.get("/metrics/db-pool")
+async def db_pool_metrics():
+    """Connection pool usage, for sizing DB_POOL_* against replica counts"""
+    return pool_status()
+
+@app.get("/metrics/hashing")
+async def hashing_metrics():
+    """Hashing pool queue depth, rejections and latency"""
+    return hasher.stats()
+
 @app.on_event("startup")
 def startup_event():
+    hasher.start()
+    tracer.start("auth-service")
     logger.info("Auth Service started")
 
+@app.on_event("shutdown")
+def shutdown_event():
+    hasher.stop()
+    tracer.stop()
+
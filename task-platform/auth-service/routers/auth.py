@@ -1,16 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 from models import User
-from passlib.context import CryptContext
+from hashing import hasher
 import jwt
 from datetime import datetime, timedelta
 import os
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
-
 # JWT Configuration
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
@@ -27,13 +26,14 @@ def create_access_token(data: dict, expires_delta=None):
     return encoded_jwt
 
 @router.post("/register")
-def register(email: str, password: str, role: str = "user", db: Session = Depends(get_db)):
-    hashed = pwd_context.hash(password)
+async def register(email: str, password: str, role: str = "user", db: AsyncSession = Depends(get_db)):
+    # Hashing is CPU-bound: it runs in the hashing process pool
+    hashed = await hasher.hash(password)
 
     user = User(email=email, password=hashed, role=role)
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
 
     access_token = create_access_token(data={"sub": str(user.id), "email": user.email, "role": user.role})
     return {
@@ -46,13 +46,13 @@ def register(email: str, password: str, role: str = "user", db: Session = Depend
 
 
 @router.post("/login")
-def login(email: str, password: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == email).first()
+async def login(email: str, password: str, db: AsyncSession = Depends(get_db)):
+    user = (await db.execute(select(User).where(User.email == email))).scalars().first()
 
     if not user:
         raise HTTPException(status_code=404, detail="Email no encontrado")
 
-    if not pwd_context.verify(password, user.password):
+    if not await hasher.verify(password, user.password):
         raise HTTPException(status_code=401, detail="Contraseña incorrecta")
 
     access_token = create_access_token(data={"sub": str(user.id), "email": user.email, "role": user.role})
@@ -0,0 +1,141 @@
+"""
+Logging estructurado del gateway, fuera del event loop.
+
+log_pipeline.start() deja en el root logger un único QueueHandler: el event loop
+solo encola el record y un hilo (QueueListener) lo formatea como una línea
+JSON y lo escribe en stdout. La cola es acotada (LOG_QUEUE_SIZE); si se
+llena, el record se descarta y se cuenta en vez de bloquear la request.
+
+Access log: una línea por request con su X-Request-ID, que el gateway acepta
+del cliente o genera y reenvía a los backends. Se escriben siempre las
+respuestas de error (>= 400, salvo 429) y las lentas
+(>= ACCESS_LOG_SLOW_SECONDS); el resto, incluidos los 429 de un cliente que
+inunda, solo con probabilidad ACCESS_LOG_SAMPLE_RATE.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+from datetime import datetime, timezone
+
+from fastapi import Request
+
+from tracing import tracer
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "0.1"))
+ACCESS_LOG_SLOW_SECONDS = float(os.getenv("ACCESS_LOG_SLOW_SECONDS", "1.0"))
+
+REQUEST_ID_HEADER = "X-Request-ID"
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+access_logger = logging.getLogger("gateway.access")
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por record; los campos de `extra={"fields": {...}}` van al nivel superior"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que nunca bloquea: con la cola llena descarta y cuenta"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El mensaje se formatea en el hilo del listener, no aquí
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    def __init__(self):
+        self.handler: DroppingQueueHandler | None = None
+        self._listener: logging.handlers.QueueListener | None = None
+
+    def start(self):
+        if self._listener is not None:
+            return
+        log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self.handler = DroppingQueueHandler(log_queue)
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter())
+        self._listener = logging.handlers.QueueListener(log_queue, stream)
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(LOG_LEVEL)
+        # httpx escribe una línea INFO por request al backend; el access log ya la cubre
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        self._listener.start()
+
+    def stop(self):
+        if self._listener is not None:
+            # Vacía lo que quede en la cola antes de salir
+            self._listener.stop()
+            self._listener = None
+
+    def stats(self) -> dict:
+        return {"dropped": self.handler.dropped if self.handler else 0}
+
+
+log_pipeline = LogPipeline()
+
+
+def request_id(request: Request) -> str:
+    """X-Request-ID del cliente si es razonable; si no, uno nuevo"""
+    incoming = request.headers.get(REQUEST_ID_HEADER)
+    if incoming and _VALID_REQUEST_ID.match(incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+
+def should_log(status_code: int, duration: float) -> bool:
+    if status_code >= 400 and status_code != 429:
+        return True
+    if duration >= ACCESS_LOG_SLOW_SECONDS:
+        return True
+    return random.random() < ACCESS_LOG_SAMPLE_RATE
+
+
+def log_access(request: Request, status_code: int, duration: float, client: str):
+    if not access_logger.isEnabledFor(logging.INFO) or not should_log(status_code, duration):
+        return
+    state = request.state
+    access_logger.info("access", extra={"fields": {
+        "request_id": getattr(state, "request_id", None),
+        "method": request.method,
+        "path": request.url.path,
+        "route": getattr(state, "route", None),
+        "upstream": getattr(state, "upstream", None),
+        "user_id": getattr(state, "user_id", None),
+        "traceparent": tracer.current_traceparent(sampled_only=True),
+        "client": client,
+        "status": status_code,
+        "duration_ms": round(duration * 1000, 2),
+    }})
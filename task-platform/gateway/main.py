@@ -1,19 +1,24 @@
 from fastapi import FastAPI, Request, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import httpx
 import jwt
-import json
 import os
 import logging
 import time
 from typing import Optional
-
-# Configuración de logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from accesslog import REQUEST_ID_HEADER, log_access, log_pipeline, request_id
+from metrics import CONTENT_TYPE, Counter, Gauge, Histogram, MetricsMiddleware, render
+from proxy import forward
+from ratelimit import client_ip, rate_limiter
+from resilience import Rejected
+from routes import ROUTES, route_table
+from upstreams import UpstreamPool
+from tracing import CLIENT, TRACEPARENT_HEADER, TracingMiddleware, tracer
+from token_cache import INTERNAL_AUTH_SECRET, INTERNAL_IDENTITY_HEADER, TokenCache, sign_identity
+
+# Configuración de logging: JSON por una cola, escrito desde otro hilo
+log_pipeline.start()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(
@@ -36,38 +41,98 @@ AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth-service:8001")
 TASK_SERVICE_URL = os.getenv("TASK_SERVICE_URL", "http://task-service:8002")
 NOTIFICATION_SERVICE_URL = os.getenv("NOTIFICATION_SERVICE_URL", "http://notification-service:8003")
 
+# Un pool de conexiones por backend, referenciado por nombre en la tabla de rutas
+UPSTREAMS = {
+    "auth": UpstreamPool("auth", AUTH_SERVICE_URL),
+    "task": UpstreamPool("task", TASK_SERVICE_URL),
+    "notification": UpstreamPool("notification", NOTIFICATION_SERVICE_URL),
+}
+# Latencia de cada backend hasta los headers de respuesta, y ocupación de sus pools
+UPSTREAM_SECONDS = Histogram("gateway_upstream_duration_seconds", "Latencia del backend hasta los headers", ("upstream",))
+UPSTREAM_ERRORS = Counter("gateway_upstream_errors_total", "Errores de conexión o timeout con el backend", ("upstream",))
+UPSTREAM_REJECTED = Counter("gateway_upstream_rejected_total", "503 sin llamar al backend (circuito o límite)", ("upstream",))
+Gauge("gateway_upstream_in_use", "Requests con conexión asignada", ("upstream",),
+      collect=lambda: {(name,): pool.in_use for name, pool in UPSTREAMS.items()})
+Gauge("gateway_upstream_queued", "Requests esperando conexión del pool", ("upstream",),
+      collect=lambda: {(name,): pool.queued for name, pool in UPSTREAMS.items()})
+Gauge("gateway_upstream_streams_open", "Streams (SSE) abiertos hacia el backend", ("upstream",),
+      collect=lambda: {(name,): pool.streams_open for name, pool in UPSTREAMS.items()})
+
+# Nombre para logs y para el 503
+UPSTREAM_LABELS = {
+    "auth": ("auth-service", "Auth service"),
+    "task": ("task-service", "Task service"),
+    "notification": ("notification-service", "Notification service"),
+}
+
 # Clave secreta JWT (debe ser la misma que en auth-service)
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-jwt-key-change-in-production-12345")
 JWT_ALGORITHM = "HS256"
 
-# Cliente HTTP asíncrono para hacer proxy requests
-http_client = httpx.AsyncClient(timeout=30.0, follow_redirects=True)
+# Claims ya verificados, por digest del token, hasta su exp
+token_cache = TokenCache()
+
+
+
+# Rate limiting antes de cualquier trabajo: primero el bucket por IP (sin
+# decodificar nada), luego el del usuario del JWT. Se registra antes que el
+# logging para que los 429 también queden en el log.
+@app.middleware("http")
+async def rate_limit(request: Request, call_next):
+    if not request.url.path.startswith("/api/"):
+        return await call_next(request)
+    try:
+        route, _ = route_table.match(request.method, request.url.path)
+    except HTTPException:
+        # 404/405: los resuelve el proxy sin llamar a ningún backend
+        return await call_next(request)
+    request.state.route = route.path
+    policy = rate_limiter.policy(route.rate_limit)
+    retry_after = await rate_limiter.check(policy, "ip", client_ip(request))
+    if not retry_after and route.auth and policy.user is not None:
+        try:
+            # Queda en el token_cache: el proxy no vuelve a decodificarlo
+            payload = await validate_jwt_token(request)
+        except HTTPException:
+            payload = None  # el proxy responde el 401
+        if payload:
+            retry_after = await rate_limiter.check(policy, "user", str(payload["user_id"]))
+    if retry_after:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "Too Many Requests"},
+            headers={"Retry-After": str(retry_after)},
+        )
+    return await call_next(request)
 
 
-# Middleware para logging de requests
+# Middleware de access log: asigna el X-Request-ID y escribe una línea
+# estructurada (muestreada) por request. La duración es hasta los headers de
+# respuesta; el cuerpo sigue en streaming.
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    """Log todas las requests con duración y status code"""
-    start_time = time.time()
-    
-    # Log request entrante
-    logger.info(f"→ {request.method} {request.url.path} from {request.client.host}")
-    
-    response = await call_next(request)
-    
-    # Calcular duración
-    duration = time.time() - start_time
-    
-    # Log response
-    logger.info(
-        f"← {request.method} {request.url.path} - "
-        f"Status: {response.status_code} - "
-        f"Duration: {duration:.3f}s"
-    )
-    
+    request.state.request_id = request_id(request)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        log_access(request, 500, time.perf_counter() - started, client_ip(request))
+        raise
+    response.headers[REQUEST_ID_HEADER] = request.state.request_id
+    log_access(request, response.status_code, time.perf_counter() - started, client_ip(request))
     return response
 
 
+# Métricas por ruta, por fuera de todo lo anterior: cuentan también los 429
+# y la duración incluye el streaming del cuerpo
+app.add_middleware(MetricsMiddleware)
+
+# Trace de cada request, la más externa: continúa el trace id del cliente o
+# abre uno nuevo, y el proxy lo propaga a los backends. El muestreo se decide
+# aquí: un cliente con "-01" no puede forzar el trazado de todo el sistema.
+app.add_middleware(TracingMiddleware, trust_sampled=False)
+
+
 # Función para validar JWT y extraer user_id
 async def validate_jwt_token(request: Request) -> Optional[dict]:
     """
@@ -87,27 +152,48 @@ async def validate_jwt_token(request: Request) -> Optional[dict]:
         
         token = auth_header.replace("Bearer ", "")
         
+        cached = token_cache.get(token)
+        if cached is not None:
+            return cached
+        
         # Decodificar y validar JWT
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        with tracer.span("jwt.decode"):
+            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
         
         # Extraer user_id del claim "sub"
         user_id = payload.get("sub")
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token payload")
         
-        logger.info(f"✓ JWT validado para user_id: {user_id}")
-        
-        return {**payload, "user_id": user_id}  # Agregar user_id para facilitar acceso
+        result = {**payload, "user_id": user_id}  # Agregar user_id para facilitar acceso
+        token_cache.put(token, result, payload.get("exp"))
+        return result
     
     except jwt.ExpiredSignatureError:
-        logger.warning("✗ JWT expirado")
+        # El 401 queda en el access log con su request_id
         raise HTTPException(status_code=401, detail="Token has expired")
     
     except jwt.InvalidTokenError as e:
-        logger.warning(f"✗ JWT inválido: {str(e)}")
+        logger.debug("JWT inválido: %s", e)
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
+def identity_headers(payload: dict) -> dict:
+    """
+    Identidad firmada para los backends en modo TRUSTED_GATEWAY: les evita
+    volver a decodificar el JWT. Vacío si no hay INTERNAL_AUTH_SECRET.
+    """
+    if not INTERNAL_AUTH_SECRET or payload.get("exp") is None:
+        return {}
+    claims = {
+        "sub": str(payload["user_id"]),
+        "email": payload.get("email"),
+        "role": payload.get("role", "user"),
+        "exp": payload["exp"]
+    }
+    return {INTERNAL_IDENTITY_HEADER: sign_identity(claims)}
+
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
@@ -123,6 +209,42 @@ async def health_check():
     }
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Métricas en formato de texto de Prometheus (scrape y HPA)"""
+    return PlainTextResponse(render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/metrics/upstreams")
+async def upstream_metrics():
+    """Uso de cada pool de conexiones a backends"""
+    return {name: pool.stats() for name, pool in UPSTREAMS.items()}
+
+
+@app.get("/metrics/rate-limit")
+async def rate_limit_metrics():
+    """Requests rechazadas con 429, por política y tipo de bucket"""
+    return rate_limiter.stats()
+
+
+@app.get("/metrics/logging")
+async def logging_metrics():
+    """Records de log descartados por cola llena"""
+    return log_pipeline.stats()
+
+
+@app.get("/metrics/tracing")
+async def tracing_metrics():
+    """Spans exportados, descartados por cola llena y perdidos por errores del exporter"""
+    return tracer.stats()
+
+
+@app.get("/metrics/token-cache")
+async def token_cache_metrics():
+    """Aciertos/fallos del cache de JWT verificados"""
+    return token_cache.stats()
+
+
 # Root endpoint
 @app.get("/")
 async def root():
@@ -133,271 +255,104 @@ async def root():
         "endpoints": {
             "auth": "/api/auth/*",
             "tasks": "/api/tasks/*",
-            "notifications": "/api/notifications/*"
+            "notifications": "/api/notifications/*",
+            "notification_stream": "/api/notifications/stream"
         },
         "docs": "/docs"
     }
 
 
-# ============================================================================
-# PROXY ROUTES - Auth Service
-# ============================================================================
-
-@app.post("/api/auth/register")
-async def proxy_register(request: Request):
-    """Proxy para registro de usuarios (sin autenticación requerida)"""
-    body = await request.json()
-    
-    try:
-        # Auth-service usa query params, no body
-        response = await http_client.post(
-            f"{AUTH_SERVICE_URL}/auth/register",
-            params={
-                "email": body.get("email"),
-                "password": body.get("password")
-            }
-        )
-        return JSONResponse(
-            status_code=response.status_code,
-            content=response.json()
-        )
-    except httpx.RequestError as e:
-        logger.error(f"Error conectando a auth-service: {str(e)}")
-        raise HTTPException(status_code=503, detail="Auth service unavailable")
-
-
-@app.post("/api/auth/login")
-async def proxy_login(request: Request):
-    """Proxy para login (sin autenticación requerida)"""
-    body = await request.json()
-    
-    try:
-        # Auth-service usa query params, no body
-        response = await http_client.post(
-            f"{AUTH_SERVICE_URL}/auth/login",
-            params={
-                "email": body.get("email"),
-                "password": body.get("password")
-            }
-        )
-        return JSONResponse(
-            status_code=response.status_code,
-            content=response.json()
-        )
-    except httpx.RequestError as e:
-        logger.error(f"Error conectando a auth-service: {str(e)}")
-        raise HTTPException(status_code=503, detail="Auth service unavailable")
+def backend_headers(payload: dict) -> dict:
+    """Identidad del usuario para el backend; Authorization se reenvía tal cual"""
+    return {"X-User-Id": str(payload.get("user_id")), **identity_headers(payload)}
 
 
 # ============================================================================
-# PROXY ROUTES - Task Service (requieren autenticación)
+# PROXY - todas las rutas /api/* se resuelven con la tabla de routes.py
 # ============================================================================
 
-@app.get("/api/tasks")
-async def proxy_get_tasks(request: Request):
-    """Proxy para listar tareas (requiere JWT)"""
-    # Validar JWT y extraer user_id
-    payload = await validate_jwt_token(request)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Authentication required")
-    
-    user_id = payload.get("user_id")
-    auth_header = request.headers.get("Authorization", "")
-    
-    try:
-        # Hacer request al task-service con JWT
-        response = await http_client.get(
-            f"{TASK_SERVICE_URL}/tasks",
-            headers={
-                "Authorization": auth_header,
-                "X-User-Id": str(user_id)
-            }
-        )
-        return JSONResponse(
-            status_code=response.status_code,
-            content=response.json()
-        )
-    except httpx.RequestError as e:
-        logger.error(f"Error conectando a task-service: {str(e)}")
-        raise HTTPException(status_code=503, detail="Task service unavailable")
-
-
-@app.post("/api/tasks")
-async def proxy_create_task(request: Request):
-    """Proxy para crear tarea (requiere JWT)"""
-    # Validar JWT
-    payload = await validate_jwt_token(request)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Authentication required")
-    
-    user_id = payload.get("user_id")
-    
-    # Leer body como bytes y decodificar manualmente
-    try:
-        body_bytes = await request.body()
-        body = json.loads(body_bytes.decode('utf-8'))
-    except Exception as e:
-        logger.error(f"Error parsing JSON: {str(e)}")
-        raise HTTPException(status_code=400, detail="Invalid JSON")
-    
-    # Agregar assigned_to automáticamente si no está presente
-    if "assigned_to" not in body:
-        body["assigned_to"] = int(user_id)
-    
-    # Obtener token original del header Authorization
-    auth_header = request.headers.get("Authorization", "")
-    
-    try:
-        response = await http_client.post(
-            f"{TASK_SERVICE_URL}/tasks",
-            json=body,
-            headers={
-                "Authorization": auth_header,  # Propagar JWT al backend
-                "X-User-Id": str(user_id)       # También enviar X-User-Id por compatibilidad
-            }
-        )
-        return JSONResponse(
-            status_code=response.status_code,
-            content=response.json()
-        )
-    except httpx.RequestError as e:
-        logger.error(f"Error conectando a task-service: {str(e)}")
-        raise HTTPException(status_code=503, detail="Task service unavailable")
-
-
-@app.get("/api/tasks/{task_id}")
-async def proxy_get_task(task_id: int, request: Request):
-    """Proxy para obtener tarea específica (requiere JWT)"""
-    payload = await validate_jwt_token(request)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Authentication required")
-    
-    user_id = payload.get("user_id")
-    auth_header = request.headers.get("Authorization", "")
-    
-    try:
-        response = await http_client.get(
-            f"{TASK_SERVICE_URL}/tasks/{task_id}",
-            headers={
-                "Authorization": auth_header,
-                "X-User-Id": str(user_id)
-            }
-        )
-        return JSONResponse(
-            status_code=response.status_code,
-            content=response.json()
-        )
-    except httpx.RequestError as e:
-        logger.error(f"Error conectando a task-service: {str(e)}")
-        raise HTTPException(status_code=503, detail="Task service unavailable")
-
-
-@app.put("/api/tasks/{task_id}")
-async def proxy_update_task(task_id: int, request: Request):
-    """Proxy para actualizar tarea (requiere JWT)"""
-    payload = await validate_jwt_token(request)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Authentication required")
+@app.api_route("/api/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def proxy(request: Request):
+    """Proxy genérico: tabla de rutas, JWT si la ruta lo pide y forward en streaming"""
+    # Rutas desconocidas se rechazan aquí, sin llamar al backend
+    route, params = route_table.match(request.method, request.url.path)
+    request.state.route = route.path
+    request.state.upstream = route.upstream
     
-    user_id = payload.get("user_id")
-    body = await request.json()
+    payload = None
+    headers = {REQUEST_ID_HEADER: request.state.request_id}
+    if route.auth:
+        payload = await validate_jwt_token(request)
+        if not payload:
+            raise HTTPException(status_code=401, detail="Authentication required")
+        request.state.user_id = payload["user_id"]
+        headers.update(backend_headers(payload))
     
-    try:
-        response = await http_client.put(
-            f"{TASK_SERVICE_URL}/tasks/{task_id}",
-            json=body,
-            headers={"X-User-Id": str(user_id)}
-        )
-        return JSONResponse(
-            status_code=response.status_code,
-            content=response.json()
-        )
-    except httpx.RequestError as e:
-        logger.error(f"Error conectando a task-service: {str(e)}")
-        raise HTTPException(status_code=503, detail="Task service unavailable")
-
-
-@app.delete("/api/tasks/{task_id}")
-async def proxy_delete_task(task_id: int, request: Request):
-    """Proxy para eliminar tarea (requiere JWT)"""
-    payload = await validate_jwt_token(request)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Authentication required")
+    options = await route.transform(request, payload) if route.transform else {}
     
-    user_id = payload.get("user_id")
+    pool = UPSTREAMS[route.upstream]
+    service_name, label = UPSTREAM_LABELS[route.upstream]
     
+    # Circuito abierto o límite de concurrencia: 503 inmediato, sin tocar el backend
     try:
-        response = await http_client.delete(
-            f"{TASK_SERVICE_URL}/tasks/{task_id}",
-            headers={"X-User-Id": str(user_id)}
-        )
-        return JSONResponse(
-            status_code=response.status_code,
-            content=response.json()
+        pool.guard.admit()
+    except Rejected as e:
+        UPSTREAM_REJECTED.inc(route.upstream)
+        raise HTTPException(
+            status_code=503,
+            detail=f"{label} unavailable",
+            headers={"Retry-After": str(e.retry_after)}
         )
-    except httpx.RequestError as e:
-        logger.error(f"Error conectando a task-service: {str(e)}")
-        raise HTTPException(status_code=503, detail="Task service unavailable")
-
-
-# ============================================================================
-# PROXY ROUTES - Notification Service (requieren autenticación)
-# ============================================================================
-
-@app.get("/api/notifications")
-async def proxy_get_notifications(request: Request):
-    """Proxy para listar notificaciones (requiere JWT)"""
-    payload = await validate_jwt_token(request)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Authentication required")
     
-    user_id = payload.get("user_id")
-    auth_header = request.headers.get("Authorization", "")
+    # Span del salto al backend; el backend continúa la traza desde aquí
+    span = tracer.start_span(f"{request.method} {service_name}", CLIENT, attributes={
+        "upstream": route.upstream,
+        "http.url": f"{pool.base_url}{route.rewrite(params)}",
+    })
+    headers[TRACEPARENT_HEADER] = span.context.traceparent
     
+    started = time.perf_counter()
     try:
-        response = await http_client.get(
-            f"{NOTIFICATION_SERVICE_URL}/notifications",
-            headers={
-                "Authorization": auth_header,
-                "X-User-Id": str(user_id)
-            }
-        )
-        return JSONResponse(
-            status_code=response.status_code,
-            content=response.json()
+        response = await forward(
+            pool, request, f"{pool.base_url}{route.rewrite(params)}",
+            method=route.upstream_method,
+            headers=headers,
+            timeout=pool.timeout(route.connect_timeout, route.read_timeout),
+            stream=route.stream,
+            **options
         )
     except httpx.RequestError as e:
-        logger.error(f"Error conectando a notification-service: {str(e)}")
-        raise HTTPException(status_code=503, detail="Notification service unavailable")
-
-
-@app.put("/api/notifications/{notification_id}/read")
-async def proxy_mark_notification_read(notification_id: int, request: Request):
-    """Proxy para marcar notificación como leída (requiere JWT)"""
-    payload = await validate_jwt_token(request)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Authentication required")
-    
-    user_id = payload.get("user_id")
-    
-    try:
-        response = await http_client.put(
-            f"{NOTIFICATION_SERVICE_URL}/notifications/{notification_id}/read",
-            headers={"X-User-Id": str(user_id)}
+        pool.guard.done(failed=True, latency=time.perf_counter() - started)
+        UPSTREAM_ERRORS.inc(route.upstream)
+        span.set_error(str(e))
+        tracer.end_span(span)
+        logger.error(
+            "Error conectando a backend",
+            extra={"fields": {"request_id": request.state.request_id, "upstream": service_name, "error": str(e)}}
         )
-        return JSONResponse(
-            status_code=response.status_code,
-            content=response.json()
-        )
-    except httpx.RequestError as e:
-        logger.error(f"Error conectando a notification-service: {str(e)}")
-        raise HTTPException(status_code=503, detail="Notification service unavailable")
+        raise HTTPException(status_code=503, detail=f"{label} unavailable")
+    except BaseException:
+        pool.guard.cancel()
+        tracer.end_span(span)
+        raise
+    # Latencia hasta los headers de respuesta; el cuerpo sigue en streaming
+    latency = time.perf_counter() - started
+    # 503 + Retry-After: el backend se está protegiendo, no está caído
+    overloaded = response.status_code == 503 and "retry-after" in response.headers
+    pool.guard.done(failed=response.status_code >= 500, latency=latency, overloaded=overloaded)
+    UPSTREAM_SECONDS.observe(latency, route.upstream)
+    span.set_attribute("http.status_code", response.status_code)
+    tracer.end_span(span)
+    return response
 
 
 # Startup event
 @app.on_event("startup")
 async def startup_event():
     """Log cuando el gateway inicia"""
+    # Un RATE_LIMIT_* mal escrito detiene el arranque aquí
+    rate_limiter.start({route.rate_limit for route in ROUTES})
+    tracer.start("gateway")
     logger.info("=" * 80)
     logger.info("🚪 API Gateway iniciado")
     logger.info(f"Auth Service: {AUTH_SERVICE_URL}")
@@ -410,10 +365,14 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cerrar conexiones HTTP al apagar"""
-    await http_client.aclose()
+    for pool in UPSTREAMS.values():
+        await pool.aclose()
+    await rate_limiter.stop()
+    tracer.stop()
     logger.info("🚪 API Gateway detenido")
+    log_pipeline.stop()
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=8000, access_log=False)
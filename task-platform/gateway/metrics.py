@@ -0,0 +1,278 @@
+"""In-process Prometheus metrics, served as text on GET /metrics.
+
+A small registry of counters, gauges and histograms: an observation is a
+dict lookup, a bisect over the bucket bounds and a few additions under a
+lock, so instrumenting a request costs microseconds. Each process keeps its
+own registry; Prometheus scrapes every pod and sums.
+
+MetricsMiddleware (plain ASGI) records per-route request counts, latency and
+in-flight requests. A text/event-stream response leaves the in-flight gauge
+once its headers are sent and is counted in http_streams_open instead, so
+idle SSE clients do not look like load to the autoscaler.
+
+instrument_engine() times every SQL statement and attributes it to the
+request that ran it, through a context variable that also reaches the
+threadpool and the async driver's greenlets. The threadpool gauges are read
+from anyio's default limiter at scrape time.
+
+Routes are labelled with their template (/tasks/{task_id}/status), never the
+raw path, to keep label cardinality bounded.
+"""
+import bisect
+import contextvars
+import threading
+import time
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_INF = 'le="+Inf"'
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), registry: Registry = REGISTRY):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in items]
+
+
+class Gauge(Counter):
+    """Set/inc/dec, or `collect` returning {label values: value} at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), collect=None, registry: Registry = REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self._collect = collect
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self):
+        if self._collect is None:
+            return super().samples()
+        try:
+            items = self._collect().items()
+        except Exception:
+            return []
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS,
+                 registry: Registry = REGISTRY):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._bounds = tuple(buckets)
+        self._series: dict[tuple, list] = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self._bounds) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        lines = []
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self._bounds, series):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            cumulative += series[len(self._bounds)]
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, _INF)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# ----------------------------------------------------------------------------
+# HTTP requests
+# ----------------------------------------------------------------------------
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time until the response was fully sent", ("method", "route"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being processed, open streams excluded")
+STREAMS_OPEN = Gauge("http_streams_open", "Open event-stream (SSE) responses")
+
+# ----------------------------------------------------------------------------
+# Database
+# ----------------------------------------------------------------------------
+
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Time of each SQL statement")
+DB_QUERIES_PER_REQUEST = Histogram("db_queries_per_request", "SQL statements run by one request", ("route",),
+                                   buckets=COUNT_BUCKETS)
+DB_SECONDS_PER_REQUEST = Histogram("db_seconds_per_request", "Total SQL time of one request", ("route",))
+
+
+class _DbUsage:
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+_db_usage: contextvars.ContextVar[_DbUsage | None] = contextvars.ContextVar("db_usage", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_started
+    DB_QUERY_SECONDS.observe(elapsed)
+    usage = _db_usage.get()
+    if usage is not None:
+        usage.count += 1
+        usage.seconds += elapsed
+
+
+def instrument_engine(engine):
+    """Time every statement of this (sync) engine; pass async_engine.sync_engine for async ones."""
+    from sqlalchemy import event
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ----------------------------------------------------------------------------
+# Threadpool (sync endpoints, sync DB sessions, run_in_threadpool)
+# ----------------------------------------------------------------------------
+
+def _threadpool(field: str):
+    def collect():
+        from anyio.to_thread import current_default_thread_limiter
+
+        limiter = current_default_thread_limiter()
+        return {(): getattr(limiter, field)}
+    return collect
+
+
+THREADPOOL_IN_USE = Gauge("threadpool_threads_in_use", "Worker threads busy in the default threadpool",
+                          collect=_threadpool("borrowed_tokens"))
+THREADPOOL_SIZE = Gauge("threadpool_threads_total", "Size of the default threadpool",
+                        collect=_threadpool("total_tokens"))
+
+
+# ----------------------------------------------------------------------------
+# Middleware
+# ----------------------------------------------------------------------------
+
+def route_label(scope) -> str:
+    # The gateway resolves its own route table and leaves the template in state
+    state_route = scope.get("state", {}).get("route")
+    if state_route:
+        return state_route
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        streaming = False
+        usage = _DbUsage()
+        token = _db_usage.set(usage)
+
+        async def send_wrapper(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                for name, value in message.get("headers", ()):
+                    if name.lower() == b"content-type" and value.startswith(b"text/event-stream"):
+                        streaming = True
+                        IN_FLIGHT.dec()
+                        STREAMS_OPEN.inc()
+                        break
+            await send(message)
+
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _db_usage.reset(token)
+            method = scope["method"]
+            route = route_label(scope)
+            REQUESTS.inc(method, route, str(status))
+            if streaming:
+                # A stream's lifetime is not request latency
+                STREAMS_OPEN.dec()
+            else:
+                IN_FLIGHT.dec()
+                REQUEST_SECONDS.observe(elapsed, method, route)
+            if usage.count:
+                DB_QUERIES_PER_REQUEST.observe(usage.count, route)
+                DB_SECONDS_PER_REQUEST.observe(usage.seconds, route)
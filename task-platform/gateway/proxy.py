@@ -0,0 +1,100 @@
+"""
+Núcleo de proxy en streaming del gateway.
+
+Reenvía cuerpos de request y response como flujos de bytes, sin parsear ni
+re-serializar JSON: status, headers y content-encoding llegan al cliente tal
+como los envió el backend, y la memoria por request no depende del tamaño
+del payload. Solo las rutas que necesitan modificar el cuerpo pasan `json_body`.
+"""
+import httpx
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from upstreams import UpstreamPool
+
+# Headers hop-by-hop (RFC 7230 §6.1) más host, que httpx fija según la URL destino
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "trailers", "transfer-encoding", "upgrade", "host",
+}
+
+# Headers de identidad que solo el gateway puede fijar
+IDENTITY_HEADERS = {"x-user-id", "x-internal-identity"}
+
+_NO_BODY = object()
+
+
+def upstream_headers(request: Request, extra: dict | None, body_replaced: bool) -> list[tuple[str, str]]:
+    """Headers del cliente sin hop-by-hop ni identidad falsificable, más los del gateway"""
+    dropped = HOP_BY_HOP_HEADERS | IDENTITY_HEADERS
+    if body_replaced:
+        # httpx recalcula longitud y tipo del cuerpo nuevo
+        dropped = dropped | {"content-length", "content-type"}
+    if extra:
+        dropped = dropped | {name.lower() for name in extra}
+    headers = [(name, value) for name, value in request.headers.items() if name not in dropped]
+    if "accept-encoding" not in request.headers:
+        # Sin esto httpx pediría gzip y el cliente recibiría bytes comprimidos que no pidió
+        headers.append(("accept-encoding", "identity"))
+    if extra:
+        headers.extend((name, value) for name, value in extra.items())
+    return headers
+
+
+def downstream_headers(response: httpx.Response) -> list[tuple[bytes, bytes]]:
+    """Headers del backend para el cliente, conservando repetidos (set-cookie)"""
+    return [
+        (name.lower(), value)
+        for name, value in response.headers.raw
+        if name.decode("latin-1").lower() not in HOP_BY_HOP_HEADERS
+    ]
+
+
+def has_body(request: Request) -> bool:
+    return "content-length" in request.headers or "transfer-encoding" in request.headers
+
+
+async def forward(
+    pool: UpstreamPool,
+    request: Request,
+    url: str,
+    *,
+    method: str | None = None,
+    headers: dict | None = None,
+    params=None,
+    json_body=_NO_BODY,
+    forward_body: bool = True,
+    timeout: httpx.Timeout | None = None,
+    stream: bool = False,
+) -> StreamingResponse:
+    """
+    Envía la request al backend y devuelve su respuesta en streaming.
+    `json_body` reemplaza el cuerpo; `forward_body=False` no envía ninguno.
+    `stream=True` usa el cliente de streams largos del pool (SSE).
+    Lanza httpx.RequestError si el backend no responde; el llamador decide el 503.
+    """
+    body_replaced = json_body is not _NO_BODY
+    stream_body = forward_body and not body_replaced and has_body(request)
+    client = pool.stream_client if stream else pool.client
+    upstream = client.build_request(
+        method or request.method,
+        url,
+        params=request.query_params if params is None else params,
+        headers=upstream_headers(request, headers, body_replaced or not forward_body),
+        content=request.stream() if stream_body else None,
+        json=json_body if body_replaced else None,
+        timeout=client.timeout if timeout is None else timeout,
+    )
+    if stream:
+        response, release = await pool.open_stream(upstream), pool.close_stream
+    else:
+        response, release = await pool.send(upstream), pool.release
+    # aiter_raw: bytes tal cual, sin descomprimir, para preservar content-encoding
+    streaming = StreamingResponse(
+        response.aiter_raw(),
+        status_code=response.status_code,
+        background=BackgroundTask(release, response),
+    )
+    streaming.raw_headers = downstream_headers(response)
+    return streaming
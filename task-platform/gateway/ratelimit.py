@@ -0,0 +1,215 @@
+"""
+Rate limiting por token bucket, por IP de cliente y por usuario (claim sub).
+
+Cada ruta de routes.py nombra una política (`rate_limit`); cada política tiene
+un bucket por IP y otro por usuario, configurados con
+RATE_LIMIT_<POLITICA>_IP y RATE_LIMIT_<POLITICA>_USER en formato
+"<requests>/<segundos>" o "<requests>/<segundos>:<ráfaga>" (vacío o 0 = sin
+límite). Un bucket se rellena a requests/segundos tokens por segundo hasta
+la ráfaga (por defecto, requests) y cada request consume uno. Las políticas
+se leen y validan al arrancar: una especificación mal escrita detiene el
+arranque en vez de devolver 500 en cada request.
+
+RATE_LIMIT_BACKEND elige dónde viven los buckets: ``local`` (en memoria, un
+LRU de RATE_LIMIT_MAX_KEYS claves), ``redis`` (compartido entre réplicas, actualizado con un script
+Lua atómico) u ``off``. Si Redis falla, la request pasa: el limitador nunca
+tumba al gateway.
+
+RATE_LIMIT_FORWARDED_HOPS: proxies de confianza delante del gateway; la IP
+del cliente es la entrada de X-Forwarded-For a esa distancia desde la derecha.
+"""
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import Request
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_FORWARDED_HOPS = int(os.getenv("RATE_LIMIT_FORWARDED_HOPS", "0"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+# Límites por defecto de cada política; las variables de entorno los reemplazan
+DEFAULT_POLICIES = {
+    "auth": {"IP": "10/60:20", "USER": ""},           # login/registro: cada intento cuesta un pbkdf2
+    "default": {"IP": "600/60:100", "USER": "300/60:60"},
+    "bulk": {"IP": "60/60:10", "USER": "10/60:5"},     # escrituras masivas
+}
+
+
+@dataclass(frozen=True)
+class Bucket:
+    rate: float      # tokens por segundo
+    burst: float     # capacidad
+
+    @classmethod
+    def parse(cls, spec: str) -> Optional["Bucket"]:
+        """ValueError si la especificación no es "<requests>/<segundos>[:<ráfaga>]" válida"""
+        spec = spec.strip()
+        if not spec or spec == "0":
+            return None
+        amount, _, rest = spec.partition("/")
+        period, _, burst = rest.partition(":")
+        try:
+            requests = float(amount)
+            seconds = float(period or 1)
+            capacity = float(burst or requests)
+        except ValueError:
+            raise ValueError(f"rate limit inválido {spec!r}: se espera <requests>/<segundos>[:<ráfaga>]") from None
+        if not all(math.isfinite(x) for x in (requests, seconds, capacity)) or requests <= 0 or seconds <= 0:
+            raise ValueError(f"rate limit inválido {spec!r}: requests y segundos deben ser positivos")
+        if capacity < 1:
+            raise ValueError(f"rate limit inválido {spec!r}: una ráfaga menor que 1 no admite ninguna request")
+        return cls(rate=requests / seconds, burst=capacity)
+
+
+@dataclass(frozen=True)
+class Policy:
+    name: str
+    ip: Optional[Bucket]
+    user: Optional[Bucket]
+
+
+def load_policy(name: str) -> Policy:
+    defaults = DEFAULT_POLICIES.get(name, DEFAULT_POLICIES["default"])
+    buckets = {}
+    for key in ("IP", "USER"):
+        variable = f"RATE_LIMIT_{name.upper()}_{key}"
+        try:
+            buckets[key] = Bucket.parse(os.getenv(variable, defaults[key]))
+        except ValueError as e:
+            raise ValueError(f"{variable}: {e}") from None
+    return Policy(name, buckets["IP"], buckets["USER"])
+
+
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_FORWARDED_HOPS > 0:
+        forwarded = [part.strip() for part in request.headers.get("X-Forwarded-For", "").split(",") if part.strip()]
+        if len(forwarded) >= RATE_LIMIT_FORWARDED_HOPS:
+            return forwarded[-RATE_LIMIT_FORWARDED_HOPS]
+    return request.client.host if request.client else "unknown"
+
+
+class LocalBuckets:
+    def __init__(self, maxsize: int = RATE_LIMIT_MAX_KEYS, clock=time.monotonic):
+        self._maxsize = maxsize
+        self._clock = clock
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()  # clave -> (tokens, instante)
+
+    async def take(self, key: str, bucket: Bucket) -> float:
+        """Consume un token; 0 si se admite, si no segundos hasta el próximo token"""
+        now = self._clock()
+        tokens, updated = self._buckets.get(key, (bucket.burst, now))
+        tokens = min(bucket.burst, tokens + (now - updated) * bucket.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / bucket.rate
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self._maxsize:
+            self._buckets.popitem(last=False)
+        return wait
+
+    async def aclose(self):
+        pass
+
+
+# Refill y consumo en un solo paso atómico, con el reloj de Redis para que
+# réplicas con relojes distintos compartan el mismo bucket
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    def __init__(self, url: str = REDIS_URL):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._take = self._redis.register_script(TAKE_SCRIPT)
+
+    async def take(self, key: str, bucket: Bucket) -> float:
+        return float(await self._take(keys=[f"rl:{key}"], args=[bucket.rate, bucket.burst]))
+
+    async def aclose(self):
+        await self._redis.aclose()
+
+
+def make_backend(name: str = RATE_LIMIT_BACKEND):
+    if name == "local":
+        return LocalBuckets()
+    if name == "redis":
+        return RedisBuckets()
+    if name == "off":
+        return None
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {name}")
+
+
+class RateLimiter:
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._policies: dict[str, Policy] = {}
+        self.rejected: dict[str, int] = {}
+
+    def start(self, policies=()):
+        """Carga y valida las políticas nombradas; ValueError si alguna está mal configurada"""
+        for name in policies:
+            self.policy(name)
+        if self._backend is None:
+            self._backend = make_backend()
+
+    async def stop(self):
+        if self._backend is not None:
+            await self._backend.aclose()
+
+    def policy(self, name: str) -> Policy:
+        policy = self._policies.get(name)
+        if policy is None:
+            policy = self._policies[name] = load_policy(name)
+        return policy
+
+    async def check(self, policy: Policy, kind: str, value: str) -> int:
+        """Consume del bucket "ip" o "user" de la política: 0 si la request pasa, si no segundos para Retry-After"""
+        bucket = policy.ip if kind == "ip" else policy.user
+        if self._backend is None or bucket is None:
+            return 0
+        try:
+            wait = await self._backend.take(f"{policy.name}:{kind}:{value}", bucket)
+        except Exception as e:
+            logger.error(f"Rate limiter no disponible, request admitida: {e}")
+            return 0
+        if wait <= 0:
+            return 0
+        reason = f"{policy.name}:{kind}"
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return max(1, math.ceil(wait))
+
+    def stats(self) -> dict:
+        return {"backend": RATE_LIMIT_BACKEND, "rejected": dict(self.rejected)}
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,192 @@
+"""
+Circuit breaker y limitador de concurrencia adaptativo por backend.
+
+CircuitBreaker: closed -> open cuando, dentro de la ventana, la tasa de
+errores (fallos de red, timeouts, 5xx) o de llamadas lentas supera su umbral
+con un mínimo de requests. Abierto rechaza todo durante `open_seconds`; luego
+pasa a half-open y deja pasar `half_open_probes` requests de prueba: si todas
+salen bien se cierra, si una falla se vuelve a abrir.
+
+AdaptiveLimiter: AIMD sobre el número de requests esperando respuesta del
+backend. Cada respuesta rápida y correcta sube el límite en 1/límite (≈ +1 por
+ronda); cada error o respuesta lenta lo multiplica por `backoff`. Lo que
+excede el límite se descarta en el acto.
+
+Un 503 con Retry-After es backpressure deliberada del backend (p. ej. la cola
+de hashing de auth-service llena), no una caída: baja el límite del
+limitador pero no cuenta como fallo del circuito, para que una ráfaga de
+logins se degrade descartando requests y no abra el circuito entero.
+
+Todo corre en el event loop, así que no hace falta ningún lock.
+"""
+import math
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class Rejected(Exception):
+    """Request descartada en el gateway sin llegar al backend"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, error_rate: float, slow_call_rate: float, slow_call_seconds: float,
+                 min_requests: int, window_seconds: float, open_seconds: float, half_open_probes: int):
+        self.error_rate = error_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.min_requests = min_requests
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.opened_count = 0
+        self._calls: deque[tuple[float, bool, bool]] = deque()  # (instante, error, lenta)
+        self._errors = 0
+        self._slow = 0
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_ok = 0
+
+    def _prune(self, now: float):
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            _, failed, slow = self._calls.popleft()
+            self._errors -= failed
+            self._slow -= slow
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_count += 1
+        self._opened_at = now
+        self._calls.clear()
+        self._errors = self._slow = 0
+
+    def allow(self):
+        """Lanza Rejected si el circuito no admite la request"""
+        if self.state == OPEN:
+            remaining = self._opened_at + self.open_seconds - time.monotonic()
+            if remaining > 0:
+                raise Rejected("circuit_open", max(1, math.ceil(remaining)))
+            self.state = HALF_OPEN
+            self._probes_started = self._probes_ok = 0
+        if self.state == HALF_OPEN:
+            if self._probes_started >= self.half_open_probes:
+                raise Rejected("circuit_half_open", 1)
+            self._probes_started += 1
+
+    def cancel(self):
+        """Request admitida que terminó sin resultado (p. ej. el cliente se desconectó)"""
+        if self.state == HALF_OPEN and self._probes_started > 0:
+            self._probes_started -= 1
+
+    def record(self, failed: bool, latency: float):
+        now = time.monotonic()
+        slow = latency >= self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            if failed or slow:
+                self._open(now)
+            else:
+                self._probes_ok += 1
+                if self._probes_ok >= self.half_open_probes:
+                    self.state = CLOSED
+            return
+        if self.state == OPEN:
+            # Respuestas de requests admitidas antes de abrir
+            return
+        self._calls.append((now, failed, slow))
+        self._errors += failed
+        self._slow += slow
+        self._prune(now)
+        total = len(self._calls)
+        if total >= self.min_requests and (
+            self._errors / total >= self.error_rate or self._slow / total >= self.slow_call_rate
+        ):
+            self._open(now)
+
+    def stats(self) -> dict:
+        self._prune(time.monotonic())
+        return {
+            "state": self.state,
+            "opened_count": self.opened_count,
+            "window_requests": len(self._calls),
+            "window_errors": self._errors,
+            "window_slow": self._slow,
+        }
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial: int, minimum: int, maximum: int, backoff: float, slow_call_seconds: float):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.slow_call_seconds = slow_call_seconds
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+
+    def acquire(self):
+        if self.in_flight >= int(self.limit):
+            raise Rejected("concurrency_limit", 1)
+        self.in_flight += 1
+
+    def cancel(self):
+        self.in_flight -= 1
+
+    def release(self, failed: bool, latency: float):
+        self.in_flight -= 1
+        if failed or latency >= self.slow_call_seconds:
+            self.limit = max(self.minimum, self.limit * self.backoff)
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def stats(self) -> dict:
+        return {"limit": int(self.limit), "in_flight": self.in_flight}
+
+
+class UpstreamGuard:
+    """Breaker + limitador de un backend, con contadores de requests descartadas"""
+
+    def __init__(self, breaker: CircuitBreaker, limiter: AdaptiveLimiter):
+        self.breaker = breaker
+        self.limiter = limiter
+        self.shed: dict[str, int] = {}
+        self.overloaded = 0
+
+    def admit(self):
+        """Lanza Rejected si hay que descartar; si no, llamar luego a done() o cancel()"""
+        try:
+            self.limiter.acquire()
+            try:
+                self.breaker.allow()
+            except Rejected:
+                self.limiter.cancel()
+                raise
+        except Rejected as e:
+            self.shed[e.reason] = self.shed.get(e.reason, 0) + 1
+            raise
+
+    def cancel(self):
+        self.limiter.cancel()
+        self.breaker.cancel()
+
+    def done(self, failed: bool, latency: float, overloaded: bool = False):
+        """overloaded: el backend descartó la request él mismo (503 + Retry-After)"""
+        if overloaded:
+            self.overloaded += 1
+            self.limiter.release(True, latency)
+            # Sin resultado para el circuito: ni fallo ni sonda exitosa
+            self.breaker.cancel()
+            return
+        self.limiter.release(failed, latency)
+        self.breaker.record(failed, latency)
+
+    def stats(self) -> dict:
+        return {"breaker": self.breaker.stats(), "limiter": self.limiter.stats(), "shed": dict(self.shed),
+                "overloaded": self.overloaded}
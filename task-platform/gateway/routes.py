@@ -0,0 +1,171 @@
+"""
+Tabla declarativa de rutas del gateway.
+
+Cada entrada de ROUTES es una línea: método y path públicos, backend, path en
+el backend, si requiere JWT, timeouts de conexión y lectura y política de
+rate limiting. Al importar el módulo la tabla se
+compila a un trie por segmentos, así que resolver una ruta cuesta lo mismo
+sin importar cuántas haya. Lo que no está en la tabla se rechaza en el
+gateway sin llamar a ningún backend.
+"""
+import json
+import os
+from urllib.parse import quote
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException, Request
+
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "2"))
+DEFAULT_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "30"))
+
+
+# ----------------------------------------------------------------------------
+# Transformaciones de cuerpo: las únicas rutas donde el gateway parsea JSON.
+# Reciben la request y el payload del JWT (None si la ruta es pública) y
+# devuelven kwargs extra para proxy.forward().
+# ----------------------------------------------------------------------------
+
+async def json_object(request: Request) -> dict:
+    """Cuerpo JSON que debe ser un objeto; cualquier otra cosa es un 400, no un 500"""
+    try:
+        body = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="JSON body must be an object")
+    return body
+
+
+async def credentials_to_query(request: Request, payload: Optional[dict]) -> dict:
+    """Auth-service usa query params, no body"""
+    body = await json_object(request)
+    return {
+        "params": {"email": body.get("email"), "password": body.get("password")},
+        "forward_body": False,
+    }
+
+
+async def default_assignee(request: Request, payload: Optional[dict]) -> dict:
+    """Agregar assigned_to automáticamente si no está presente"""
+    body = await json_object(request)
+    if "assigned_to" not in body:
+        body["assigned_to"] = int(payload["user_id"])
+    return {"json_body": body}
+
+
+Transform = Callable[[Request, Optional[dict]], Awaitable[dict]]
+
+
+@dataclass(frozen=True)
+class Route:
+    method: str
+    path: str                       # público, con {param}
+    upstream: str                   # nombre del pool en main.py
+    target: str                     # path en el backend, con los mismos {param}
+    auth: bool = True
+    connect_timeout: float = DEFAULT_CONNECT_TIMEOUT
+    read_timeout: Optional[float] = DEFAULT_READ_TIMEOUT  # None: sin límite (streams)
+    stream: bool = False                        # conexión larga: fuera del pool limitado del backend
+    upstream_method: Optional[str] = None       # si el backend usa otro método
+    rate_limit: str = "default"                 # política de ratelimit.py
+    transform: Optional[Transform] = None
+
+    def rewrite(self, params: dict) -> str:
+        return self.target.format(**{name: quote(value, safe="") for name, value in params.items()})
+
+
+ROUTES = [
+    Route("POST",   "/api/auth/register",                         "auth",         "/auth/register", auth=False, read_timeout=10, rate_limit="auth", transform=credentials_to_query),
+    Route("POST",   "/api/auth/login",                            "auth",         "/auth/login",    auth=False, read_timeout=10, rate_limit="auth", transform=credentials_to_query),
+    Route("GET",    "/api/tasks",                                 "task",         "/tasks/assigned"),
+    Route("GET",    "/api/tasks/created",                         "task",         "/tasks/created"),
+    Route("GET",    "/api/tasks/search",                          "task",         "/tasks/search"),
+    Route("GET",    "/api/tasks/stats",                           "task",         "/tasks/stats"),
+    Route("POST",   "/api/tasks",                                 "task",         "/tasks/", transform=default_assignee),
+    Route("POST",   "/api/tasks/bulk",                            "task",         "/tasks/bulk", rate_limit="bulk"),
+    Route("POST",   "/api/tasks/reassign",                        "task",         "/tasks/reassign", rate_limit="bulk"),
+    Route("PATCH",  "/api/tasks/{task_id}/status",                "task",         "/tasks/{task_id}/status"),
+    Route("DELETE", "/api/tasks/{task_id}",                       "task",         "/tasks/{task_id}"),
+    Route("GET",    "/api/notifications",                         "notification", "/notifications"),
+    Route("GET",    "/api/notifications/unread-count",            "notification", "/notifications/unread-count"),
+    Route("GET",    "/api/notifications/stream",                  "notification", "/notifications/stream", read_timeout=None, stream=True),
+    Route("POST",   "/api/notifications/mark-read",               "notification", "/notifications/mark-read"),
+    Route("POST",   "/api/notifications/mark-all-read",           "notification", "/notifications/mark-all-read"),
+    Route("PATCH",  "/api/notifications/{notification_id}/read",  "notification", "/notifications/{notification_id}/read"),
+    Route("PUT",    "/api/notifications/{notification_id}/read",  "notification", "/notifications/{notification_id}/read", upstream_method="PATCH"),
+]
+
+
+class _Node:
+    __slots__ = ("children", "param", "param_node", "routes")
+
+    def __init__(self):
+        self.children: dict[str, "_Node"] = {}
+        self.param: Optional[str] = None
+        self.param_node: Optional["_Node"] = None
+        self.routes: dict[str, Route] = {}
+
+
+class RouteTable:
+    """Trie de segmentos de path; los segmentos literales tienen prioridad sobre {param}"""
+
+    def __init__(self, routes: list[Route]):
+        self._root = _Node()
+        for route in routes:
+            self._add(route)
+
+    @staticmethod
+    def _segments(path: str) -> list[str]:
+        return [segment for segment in path.split("/") if segment]
+
+    def _add(self, route: Route):
+        node = self._root
+        for segment in self._segments(route.path):
+            if segment.startswith("{") and segment.endswith("}"):
+                name = segment[1:-1]
+                if node.param_node is None:
+                    node.param, node.param_node = name, _Node()
+                elif node.param != name:
+                    raise ValueError(f"Conflicting parameter names at {route.path}")
+                node = node.param_node
+            else:
+                node = node.children.setdefault(segment, _Node())
+        if route.method in node.routes:
+            raise ValueError(f"Duplicate route {route.method} {route.path}")
+        node.routes[route.method] = route
+
+    def _find(self, node: _Node, segments: list[str], index: int, params: dict) -> Optional[_Node]:
+        if index == len(segments):
+            return node if node.routes else None
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            found = self._find(child, segments, index + 1, params)
+            if found is not None:
+                return found
+        if node.param_node is not None:
+            params[node.param] = segment
+            found = self._find(node.param_node, segments, index + 1, params)
+            if found is not None:
+                return found
+            del params[node.param]
+        return None
+
+    def match(self, method: str, path: str) -> tuple[Route, dict]:
+        """Ruta y parámetros del path; 404 si el path no existe, 405 si el método no"""
+        params: dict = {}
+        node = self._find(self._root, self._segments(path), 0, params)
+        if node is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        route = node.routes.get(method)
+        if route is None:
+            raise HTTPException(
+                status_code=405,
+                detail="Method Not Allowed",
+                headers={"Allow": ", ".join(sorted(node.routes))},
+            )
+        return route, params
+
+
+route_table = RouteTable(ROUTES)
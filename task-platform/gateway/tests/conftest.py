@@ -0,0 +1,5 @@
+import os
+import sys
+
+# El gateway importa sus módulos sin paquete (from routes import ...), como en la imagen
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
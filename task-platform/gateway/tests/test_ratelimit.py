@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from ratelimit import Bucket, LocalBuckets, Policy, RateLimiter, load_policy
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def take(buckets, key, bucket):
+    return asyncio.run(buckets.take(key, bucket))
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("10/60", Bucket(rate=10 / 60, burst=10)),
+    ("10/60:20", Bucket(rate=10 / 60, burst=20)),
+    (" 5/1 ", Bucket(rate=5, burst=5)),
+    ("5", Bucket(rate=5, burst=5)),
+    ("", None),
+    ("0", None),
+])
+def test_parse(spec, expected):
+    assert Bucket.parse(spec) == expected
+
+
+@pytest.mark.parametrize("spec", ["10/minute", "abc", "10/0", "-1/60", "10/60:0.5", "inf/1", "10/60:x"])
+def test_parse_rejects_malformed_specs(spec):
+    with pytest.raises(ValueError):
+        Bucket.parse(spec)
+
+
+def test_load_policy_names_the_variable(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_BULK_USER", "10/minute")
+    with pytest.raises(ValueError, match="RATE_LIMIT_BULK_USER"):
+        load_policy("bulk")
+
+
+def test_start_fails_fast_on_a_bad_policy(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_AUTH_IP", "nope")
+    with pytest.raises(ValueError, match="RATE_LIMIT_AUTH_IP"):
+        RateLimiter(backend=LocalBuckets()).start({"default", "auth"})
+
+
+def test_burst_then_refill():
+    clock = Clock()
+    buckets = LocalBuckets(clock=clock)
+    bucket = Bucket(rate=1.0, burst=3)
+    assert [take(buckets, "k", bucket) for _ in range(3)] == [0, 0, 0]
+    assert take(buckets, "k", bucket) == pytest.approx(1.0)
+    clock.now += 0.5
+    assert take(buckets, "k", bucket) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert take(buckets, "k", bucket) == 0
+
+
+def test_refill_is_capped_at_the_burst():
+    clock = Clock()
+    buckets = LocalBuckets(clock=clock)
+    bucket = Bucket(rate=1.0, burst=2)
+    take(buckets, "k", bucket)
+    clock.now += 3600
+    assert [take(buckets, "k", bucket) for _ in range(2)] == [0, 0]
+    assert take(buckets, "k", bucket) > 0
+
+
+def test_keys_are_independent_and_evicted_least_recently_used():
+    clock = Clock()
+    buckets = LocalBuckets(maxsize=2, clock=clock)
+    bucket = Bucket(rate=0.001, burst=1)
+    take(buckets, "a", bucket)
+    take(buckets, "b", bucket)
+    assert take(buckets, "a", bucket) > 0
+    take(buckets, "c", bucket)
+    # "b" era la clave usada hace más tiempo: se descartó y vuelve con el bucket lleno
+    assert take(buckets, "b", bucket) == 0
+
+
+def test_check_returns_retry_after_and_counts_rejections():
+    limiter = RateLimiter(backend=LocalBuckets(clock=Clock()))
+    policy = Policy("auth", ip=Bucket(rate=0.1, burst=1), user=None)
+    assert asyncio.run(limiter.check(policy, "ip", "1.2.3.4")) == 0
+    assert asyncio.run(limiter.check(policy, "ip", "1.2.3.4")) == 10
+    assert asyncio.run(limiter.check(policy, "user", "7")) == 0
+    assert limiter.stats()["rejected"] == {"auth:ip": 1}
+
+
+def test_check_admits_when_the_backend_fails():
+    class Broken:
+        async def take(self, key, bucket):
+            raise ConnectionError("redis down")
+
+    limiter = RateLimiter(backend=Broken())
+    policy = Policy("default", ip=Bucket(rate=1, burst=1), user=None)
+    assert asyncio.run(limiter.check(policy, "ip", "1.2.3.4")) == 0
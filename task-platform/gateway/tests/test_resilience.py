@@ -0,0 +1,160 @@
+import pytest
+
+import resilience
+from resilience import CLOSED, HALF_OPEN, OPEN, AdaptiveLimiter, CircuitBreaker, Rejected, UpstreamGuard
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+def breaker(**overrides):
+    options = dict(error_rate=0.5, slow_call_rate=0.8, slow_call_seconds=1.0, min_requests=4,
+                   window_seconds=10, open_seconds=5, half_open_probes=2)
+    options.update(overrides)
+    return CircuitBreaker(**options)
+
+
+def limiter(**overrides):
+    options = dict(initial=4, minimum=2, maximum=8, backoff=0.5, slow_call_seconds=1.0)
+    options.update(overrides)
+    return AdaptiveLimiter(**options)
+
+
+def test_breaker_needs_min_requests_before_opening(clock):
+    b = breaker()
+    for _ in range(3):
+        b.record(True, 0.01)
+    assert b.state == CLOSED
+    b.record(True, 0.01)
+    assert b.state == OPEN
+    assert b.opened_count == 1
+
+
+def test_breaker_opens_on_slow_calls(clock):
+    b = breaker()
+    for _ in range(4):
+        b.record(False, 2.0)
+    assert b.state == OPEN
+
+
+def test_breaker_forgets_calls_outside_the_window(clock):
+    b = breaker()
+    for _ in range(3):
+        b.record(True, 0.01)
+    clock.now += 11
+    b.record(True, 0.01)
+    assert b.state == CLOSED
+    assert b.stats()["window_errors"] == 1
+
+
+def test_open_breaker_rejects_with_retry_after_then_half_opens(clock):
+    b = breaker()
+    for _ in range(4):
+        b.record(True, 0.01)
+    clock.now += 1.5
+    with pytest.raises(Rejected) as e:
+        b.allow()
+    assert (e.value.reason, e.value.retry_after) == ("circuit_open", 4)
+    clock.now += 4
+    b.allow()
+    assert b.state == HALF_OPEN
+
+
+def test_half_open_closes_after_successful_probes(clock):
+    b = breaker(min_requests=1)
+    b.record(True, 0.01)
+    clock.now += 5
+    b.allow()
+    b.allow()
+    with pytest.raises(Rejected) as e:
+        b.allow()
+    assert e.value.reason == "circuit_half_open"
+    b.record(False, 0.01)
+    b.record(False, 0.01)
+    assert b.state == CLOSED
+
+
+def test_half_open_reopens_on_a_failed_probe(clock):
+    b = breaker(min_requests=1)
+    b.record(True, 0.01)
+    clock.now += 5
+    b.allow()
+    b.record(True, 0.01)
+    assert b.state == OPEN
+    assert b.opened_count == 2
+
+
+def test_cancelled_probe_frees_its_slot(clock):
+    b = breaker(min_requests=1, half_open_probes=1)
+    b.record(True, 0.01)
+    clock.now += 5
+    b.allow()
+    b.cancel()
+    b.allow()
+
+
+def test_limiter_sheds_above_the_limit():
+    lim = limiter()
+    for _ in range(4):
+        lim.acquire()
+    with pytest.raises(Rejected) as e:
+        lim.acquire()
+    assert e.value.reason == "concurrency_limit"
+
+
+def test_limiter_increases_additively_and_is_capped():
+    lim = limiter(initial=4, maximum=5)
+    lim.acquire()
+    lim.release(False, 0.01)
+    assert lim.limit == 4.25
+    for _ in range(50):
+        lim.acquire()
+        lim.release(False, 0.01)
+    assert lim.limit == 5
+
+
+def test_limiter_decreases_multiplicatively_down_to_the_minimum():
+    lim = limiter(initial=8, minimum=2, backoff=0.5)
+    lim.acquire()
+    lim.release(True, 0.01)
+    assert lim.limit == 4
+    lim.acquire()
+    lim.release(False, 5.0)
+    assert lim.limit == 2
+    lim.acquire()
+    lim.release(True, 0.01)
+    assert lim.limit == 2
+    assert lim.in_flight == 0
+
+
+def test_guard_admit_returns_the_limiter_slot_when_the_breaker_rejects(clock):
+    guard = UpstreamGuard(breaker(min_requests=1), limiter())
+    guard.admit()
+    guard.done(True, 0.01)
+    with pytest.raises(Rejected):
+        guard.admit()
+    assert guard.limiter.in_flight == 0
+    assert guard.shed == {"circuit_open": 1}
+
+
+def test_overloaded_responses_lower_the_limit_without_opening_the_circuit(clock):
+    guard = UpstreamGuard(breaker(min_requests=4), limiter(initial=8, backoff=0.5))
+    for _ in range(10):
+        guard.admit()
+        guard.done(True, 0.01, overloaded=True)
+    assert guard.breaker.state == CLOSED
+    assert guard.breaker.stats()["window_errors"] == 0
+    assert guard.limiter.limit == 2
+    assert guard.overloaded == 10
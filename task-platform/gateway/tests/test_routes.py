@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from routes import Route, RouteTable, json_object, route_table
+
+
+def table(*specs):
+    return RouteTable([Route(method, path, "task", path) for method, path in specs])
+
+
+def test_literal_segments_win_over_parameters():
+    route, params = route_table.match("GET", "/api/tasks/created")
+    assert (route.target, params) == ("/tasks/created", {})
+    route, params = route_table.match("DELETE", "/api/tasks/42")
+    assert (route.target, params) == ("/tasks/{task_id}", {"task_id": "42"})
+
+
+def test_backtracks_from_a_literal_branch_that_dead_ends():
+    routes = table(("GET", "/a/b/d"), ("GET", "/a/{x}/c"))
+    route, params = routes.match("GET", "/a/b/c")
+    assert (route.path, params) == ("/a/{x}/c", {"x": "b"})
+    route, params = routes.match("GET", "/a/b/d")
+    assert (route.path, params) == ("/a/b/d", {})
+
+
+def test_params_of_an_abandoned_branch_are_not_leaked():
+    routes = table(("GET", "/a/{x}/c"), ("GET", "/{y}/b/d"))
+    route, params = routes.match("GET", "/a/b/d")
+    assert (route.path, params) == ("/{y}/b/d", {"y": "a"})
+
+
+def test_empty_segments_and_trailing_slashes_are_ignored():
+    route, _ = route_table.match("GET", "/api/tasks/")
+    assert route.target == "/tasks/assigned"
+    route, _ = route_table.match("GET", "//api//tasks")
+    assert route.target == "/tasks/assigned"
+
+
+def test_unknown_path_is_404():
+    with pytest.raises(HTTPException) as e:
+        route_table.match("GET", "/api/nope")
+    assert e.value.status_code == 404
+    # Un prefijo de una ruta no es una ruta
+    with pytest.raises(HTTPException) as e:
+        table(("GET", "/a/b")).match("GET", "/a")
+    assert e.value.status_code == 404
+
+
+def test_known_path_with_another_method_is_405_with_allow():
+    with pytest.raises(HTTPException) as e:
+        route_table.match("PUT", "/api/tasks/7")
+    assert e.value.status_code == 405
+    assert e.value.headers == {"Allow": "DELETE"}
+
+
+def test_conflicting_parameter_names_are_rejected():
+    with pytest.raises(ValueError, match="Conflicting"):
+        table(("GET", "/a/{x}"), ("DELETE", "/a/{y}"))
+
+
+def test_duplicate_routes_are_rejected():
+    with pytest.raises(ValueError, match="Duplicate"):
+        table(("GET", "/a/{x}"), ("GET", "/a/{x}"))
+
+
+def test_rewrite_quotes_parameters():
+    route, _ = route_table.match("DELETE", "/api/tasks/7")
+    assert route.rewrite({"task_id": "1/../admin"}) == "/tasks/1%2F..%2Fadmin"
+
+
+def request_with(body: bytes) -> Request:
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": []}, receive)
+
+
+@pytest.mark.parametrize("body", [b"", b"{", b"[1, 2]", b'"texto"', b"null"])
+def test_json_object_rejects_non_objects_with_400(body):
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(json_object(request_with(body)))
+    assert e.value.status_code == 400
+
+
+def test_json_object_returns_the_object():
+    assert asyncio.run(json_object(request_with(b'{"email": "a@b.c"}'))) == {"email": "a@b.c"}
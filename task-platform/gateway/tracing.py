@@ -0,0 +1,392 @@
+"""Distributed tracing with W3C trace context (traceparent).
+
+Each service continues the trace of the incoming traceparent header, or
+starts one, and passes it on to the calls it makes: the gateway to its
+backends, task-service to notification-service through the outbox (the
+traceparent is stored with the task event and the outbox row, so the
+asynchronous hop still joins the request that caused it).
+
+Spans cover each HTTP request (TracingMiddleware), every SQL statement
+(trace_engine), password hashing and the outbound calls. Sampling is decided
+once at the root, at TRACE_SAMPLE_RATE, and followed by every service
+downstream. The gateway is the root for sampling: it keeps an external
+caller's trace id but ignores its sampled flag, so clients cannot force
+tracing on; an unsampled request only carries ids, records nothing and costs
+a couple of random numbers. Finished spans go through a bounded queue to an
+exporter thread, so the request never waits on the exporter; when the queue
+is full spans are dropped and counted.
+
+TRACE_EXPORTER picks the exporter: ``none`` (default), ``file`` (one JSON
+line per span in TRACE_FILE, for tests and local runs) or ``otlp`` (OTLP/HTTP
+JSON to TRACE_OTLP_ENDPOINT, e.g. an OpenTelemetry Collector or Jaeger).
+Any object with export(spans, service) and close() can be passed to tracer.start().
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from metrics import route_label
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_FILE = os.getenv("TRACE_FILE", "/tmp/traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://otel-collector:4318/v1/traces")
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "2048"))
+TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", "512"))
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "2.0"))
+
+TRACEPARENT_HEADER = "traceparent"
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_STATEMENT_LIMIT = 500
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+
+
+class SpanContext(NamedTuple):
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(value: str | None) -> SpanContext | None:
+    match = _TRACEPARENT.match(value.strip().lower()) if value else None
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return SpanContext(match.group(1), match.group(2), bool(int(match.group(3), 16) & 1))
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits) or 1:0{bits // 4}x}"
+
+
+class Span:
+    __slots__ = ("name", "kind", "context", "parent_id", "links", "attributes", "error", "start_ns", "end_ns")
+
+    def __init__(self, name: str, kind: int, context: SpanContext, parent_id: str | None, links=()):
+        self.name = name
+        self.kind = kind
+        self.context = context
+        self.parent_id = parent_id
+        self.links = list(links)
+        self.attributes: dict = {}
+        self.error: str | None = None
+        self.start_ns = time.time_ns()
+        self.end_ns: int | None = None
+
+    @property
+    def sampled(self) -> bool:
+        return self.context.sampled
+
+    def set_attribute(self, key: str, value):
+        if self.context.sampled and value is not None:
+            self.attributes[key] = value
+
+    def set_error(self, message: str):
+        if self.context.sampled:
+            self.error = message[:500]
+
+    def to_dict(self) -> dict:
+        return {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "links": [{"traceId": link.trace_id, "spanId": link.span_id} for link in self.links],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 0},
+        }
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+
+
+# ----------------------------------------------------------------------------
+# Exporters
+# ----------------------------------------------------------------------------
+
+class FileExporter:
+    def __init__(self, path: str = TRACE_FILE):
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, spans: list[dict], service: str):
+        for span in spans:
+            self._file.write(json.dumps({"service": service, **span}) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class OtlpHttpExporter:
+    def __init__(self, endpoint: str = TRACE_OTLP_ENDPOINT, timeout: float = 5.0):
+        self._endpoint = endpoint
+        self._timeout = timeout
+
+    def export(self, spans: list[dict], service: str):
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+            "scopeSpans": [{"scope": {"name": "task-platform"}, "spans": spans}],
+        }]}
+        request = urllib.request.Request(
+            self._endpoint, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=self._timeout) as response:
+            response.read()
+
+    def close(self):
+        pass
+
+
+def make_exporter(name: str = TRACE_EXPORTER):
+    if name == "none":
+        return None
+    if name == "file":
+        return FileExporter()
+    if name == "otlp":
+        return OtlpHttpExporter()
+    raise ValueError(f"Unknown TRACE_EXPORTER: {name}")
+
+
+# ----------------------------------------------------------------------------
+# Tracer
+# ----------------------------------------------------------------------------
+
+class Tracer:
+    def __init__(self, sample_rate: float = TRACE_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.service = "unknown"
+        self._exporter = None
+        self._queue: queue.Queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self, service: str, exporter=None):
+        self.service = service
+        if self._thread and self._thread.is_alive():
+            return
+        self._exporter = exporter if exporter is not None else make_exporter()
+        if self._exporter is None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._exporter is not None:
+            self._exporter.close()
+            self._exporter = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._exporter is not None
+
+    def start_span(self, name: str, kind: int = INTERNAL, parent: SpanContext | None = None,
+                   links=(), attributes: dict | None = None) -> Span:
+        """New span, child of `parent` or else of the current span; a root span if neither."""
+        if parent is None:
+            current = _current_span.get()
+            parent = current.context if current is not None else None
+        if parent is None:
+            context = SpanContext(_new_id(128), _new_id(64), self.sample())
+        else:
+            context = SpanContext(parent.trace_id, _new_id(64), parent.sampled and self.enabled)
+        span = Span(name, kind, context, parent.span_id if parent else None, links)
+        if attributes and context.sampled:
+            span.attributes.update(attributes)
+        return span
+
+    def sample(self) -> bool:
+        """Local sampling decision for a new trace."""
+        return self.enabled and random.random() < self.sample_rate
+
+    def end_span(self, span: Span):
+        if not span.sampled:
+            return
+        span.end_ns = time.time_ns()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    @contextmanager
+    def span(self, name: str, kind: int = INTERNAL, parent: SpanContext | None = None,
+             links=(), attributes: dict | None = None):
+        span = self.start_span(name, kind, parent, links, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end_span(span)
+
+    def current_traceparent(self, sampled_only: bool = False) -> str | None:
+        span = _current_span.get()
+        if span is None or (sampled_only and not span.sampled):
+            return None
+        return span.context.traceparent
+
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=TRACE_FLUSH_INTERVAL))
+                while len(batch) < TRACE_BATCH_SIZE:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                continue
+            try:
+                self._exporter.export([span.to_dict() for span in batch], self.service)
+                self.exported += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                logger.warning(f"Trace export failed, {len(batch)} spans lost: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "exporter": type(self._exporter).__name__ if self.enabled else None,
+            "sample_rate": self.sample_rate,
+            "queued": self._queue.qsize(),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+tracer = Tracer()
+
+
+# ----------------------------------------------------------------------------
+# SQLAlchemy
+# ----------------------------------------------------------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    current = _current_span.get()
+    if current is None or not current.sampled:
+        context._trace_span = None
+        return
+    span = tracer.start_span("db.query", CLIENT, attributes={
+        "db.system": conn.dialect.name,
+        "db.statement": statement[:_STATEMENT_LIMIT],
+    })
+    if executemany:
+        span.set_attribute("db.executemany", True)
+    context._trace_span = span
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    span = getattr(context, "_trace_span", None)
+    if span is not None:
+        span.set_attribute("db.rowcount", cursor.rowcount)
+        tracer.end_span(span)
+        context._trace_span = None
+
+
+def _handle_error(exception_context):
+    span = getattr(exception_context.execution_context, "_trace_span", None)
+    if span is not None:
+        span.set_error(str(exception_context.original_exception))
+        tracer.end_span(span)
+        exception_context.execution_context._trace_span = None
+
+
+def trace_engine(engine):
+    """One span per statement of this (sync) engine; pass async_engine.sync_engine for async ones."""
+    from sqlalchemy import event
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+# ----------------------------------------------------------------------------
+# Middleware
+# ----------------------------------------------------------------------------
+
+class TracingMiddleware:
+    """Server span per request, continuing the caller's traceparent.
+
+    The span is named after the route template once the app has matched it
+    (see metrics.route_label); it lasts until the response body is sent.
+    With trust_sampled=False (the edge) the incoming trace id is kept but the
+    sampling decision is made here.
+    """
+
+    def __init__(self, app, trust_sampled: bool = True):
+        self.app = app
+        self.trust_sampled = trust_sampled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        parent = request_id = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                parent = parse_traceparent(value.decode("latin-1"))
+            elif name == b"x-request-id":
+                request_id = value.decode("latin-1")
+        if parent is not None and not self.trust_sampled:
+            parent = parent._replace(sampled=tracer.sample())
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with tracer.span(scope["method"], SERVER, parent=parent) as span:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                if span.sampled:
+                    route = route_label(scope)
+                    span.name = f"{scope['method']} {route}"
+                    span.set_attribute("http.method", scope["method"])
+                    span.set_attribute("http.route", route)
+                    span.set_attribute("http.target", scope["path"])
+                    span.set_attribute("http.status_code", status)
+                    span.set_attribute("request_id", scope.get("state", {}).get("request_id", request_id))
+                    if status >= 500:
+                        span.set_error(f"HTTP {status}")
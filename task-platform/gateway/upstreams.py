@@ -0,0 +1,184 @@
+"""
+Un pool de conexiones httpx por backend.
+
+Cada backend tiene su propio AsyncClient con límites, keep-alive y HTTP/2
+configurables, de modo que agotar el pool de un servicio lento no bloquea el
+tráfico hacia los demás. Cada pool cuenta requests en cola (esperando
+conexión), en uso (con conexión asignada, hasta cerrar la respuesta) y un
+histograma de latencia de adquisición, medido con el trace de httpcore y
+exportado también a Prometheus (gateway_upstream_acquire_seconds).
+
+Los streams de larga duración (SSE) van por un segundo cliente del mismo
+backend, limitado por UPSTREAM_MAX_STREAMS y no por UPSTREAM_MAX_CONNECTIONS:
+miles de streams inactivos no dejan sin conexiones a las rutas normales.
+
+Variables de entorno, globales o por backend (UPSTREAM_<NOMBRE>_<CLAVE>,
+que tiene prioridad):
+  UPSTREAM_MAX_CONNECTIONS, UPSTREAM_MAX_KEEPALIVE, UPSTREAM_KEEPALIVE_EXPIRY,
+  UPSTREAM_POOL_TIMEOUT, UPSTREAM_HTTP2, UPSTREAM_MAX_STREAMS,
+  UPSTREAM_BREAKER_ERROR_RATE, UPSTREAM_BREAKER_SLOW_CALL_RATE,
+  UPSTREAM_BREAKER_SLOW_CALL_SECONDS, UPSTREAM_BREAKER_MIN_REQUESTS,
+  UPSTREAM_BREAKER_WINDOW, UPSTREAM_BREAKER_OPEN_SECONDS,
+  UPSTREAM_BREAKER_HALF_OPEN_PROBES,
+  UPSTREAM_LIMIT_INITIAL, UPSTREAM_LIMIT_MIN, UPSTREAM_LIMIT_BACKOFF
+"""
+import bisect
+import os
+import time
+
+import httpx
+
+from metrics import Counter, Histogram
+from resilience import AdaptiveLimiter, CircuitBreaker, UpstreamGuard
+
+# Límites superiores en segundos; el último bucket es +Inf
+ACQUIRE_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+ACQUIRE_SECONDS = Histogram("gateway_upstream_acquire_seconds", "Espera hasta tener conexión del pool del backend",
+                            ("upstream",), buckets=ACQUIRE_BUCKETS)
+POOL_TIMEOUTS = Counter("gateway_upstream_pool_timeouts_total", "Requests que no obtuvieron conexión a tiempo",
+                        ("upstream",))
+
+
+def upstream_setting(name: str, key: str, default: str) -> str:
+    return os.getenv(f"UPSTREAM_{name.upper()}_{key}", os.getenv(f"UPSTREAM_{key}", default))
+
+
+class UpstreamPool:
+    def __init__(self, name: str, base_url: str):
+        self.name = name
+        self.base_url = base_url
+        self.max_connections = int(upstream_setting(name, "MAX_CONNECTIONS", "100"))
+        self.max_keepalive = int(upstream_setting(name, "MAX_KEEPALIVE", "20"))
+        self.keepalive_expiry = float(upstream_setting(name, "KEEPALIVE_EXPIRY", "30"))
+        # Tiempo máximo esperando una conexión libre del pool
+        self.pool_timeout = float(upstream_setting(name, "POOL_TIMEOUT", "5"))
+        # HTTP/2 solo se negocia por TLS (ALPN); contra http:// httpx sigue en HTTP/1.1
+        self.http2 = upstream_setting(name, "HTTP2", "false").lower() in ("1", "true", "yes")
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            http2=self.http2,
+            timeout=httpx.Timeout(30.0, pool=self.pool_timeout),
+        )
+        # Conexiones para streams: cada una queda ocupada mientras el stream siga abierto
+        self.max_streams = int(upstream_setting(name, "MAX_STREAMS", "10000"))
+        self.stream_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_streams,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            http2=self.http2,
+            timeout=httpx.Timeout(30.0, pool=self.pool_timeout),
+        )
+        self.streams_open = 0
+        slow_call_seconds = float(upstream_setting(name, "BREAKER_SLOW_CALL_SECONDS", "5"))
+        self.guard = UpstreamGuard(
+            CircuitBreaker(
+                error_rate=float(upstream_setting(name, "BREAKER_ERROR_RATE", "0.5")),
+                slow_call_rate=float(upstream_setting(name, "BREAKER_SLOW_CALL_RATE", "0.8")),
+                slow_call_seconds=slow_call_seconds,
+                min_requests=int(upstream_setting(name, "BREAKER_MIN_REQUESTS", "20")),
+                window_seconds=float(upstream_setting(name, "BREAKER_WINDOW", "10")),
+                open_seconds=float(upstream_setting(name, "BREAKER_OPEN_SECONDS", "5")),
+                half_open_probes=int(upstream_setting(name, "BREAKER_HALF_OPEN_PROBES", "3")),
+            ),
+            # El máximo es el tamaño del pool: más concurrencia solo esperaría conexión
+            AdaptiveLimiter(
+                initial=int(upstream_setting(name, "LIMIT_INITIAL", "20")),
+                minimum=int(upstream_setting(name, "LIMIT_MIN", "2")),
+                maximum=self.max_connections,
+                backoff=float(upstream_setting(name, "LIMIT_BACKOFF", "0.9")),
+                slow_call_seconds=slow_call_seconds,
+            ),
+        )
+        self.queued = 0
+        self.in_use = 0
+        self.pool_timeouts = 0
+        self._acquire_buckets = [0] * (len(ACQUIRE_BUCKETS) + 1)
+        self._acquire_sum = 0.0
+        self._acquire_count = 0
+
+    def timeout(self, connect: float, read: float | None) -> httpx.Timeout:
+        return httpx.Timeout(connect, connect=connect, read=read, pool=self.pool_timeout)
+
+    def _acquired(self, started: float):
+        elapsed = time.perf_counter() - started
+        self.queued -= 1
+        self.in_use += 1
+        self._acquire_buckets[bisect.bisect_left(ACQUIRE_BUCKETS, elapsed)] += 1
+        self._acquire_sum += elapsed
+        self._acquire_count += 1
+        ACQUIRE_SECONDS.observe(elapsed, self.name)
+
+    async def send(self, request: httpx.Request) -> httpx.Response:
+        """Envía en streaming; llamar a release() cuando la respuesta se cierre"""
+        started = time.perf_counter()
+        acquired = False
+
+        async def trace(event: str, info: dict):
+            nonlocal acquired
+            # Primer byte enviado: ya hay conexión (reusada o recién abierta)
+            if not acquired and event.endswith("send_request_headers.started"):
+                acquired = True
+                self._acquired(started)
+
+        self.queued += 1
+        request.extensions["trace"] = trace
+        try:
+            response = await self.client.send(request, stream=True)
+        except BaseException as e:
+            if acquired:
+                self.in_use -= 1
+            else:
+                self.queued -= 1
+            if isinstance(e, httpx.PoolTimeout):
+                self.pool_timeouts += 1
+                POOL_TIMEOUTS.inc(self.name)
+            raise
+        if not acquired:
+            # Transportes sin trace (p. ej. ASGITransport en pruebas)
+            self._acquired(started)
+        return response
+
+    async def release(self, response: httpx.Response):
+        await response.aclose()
+        self.in_use -= 1
+
+    async def open_stream(self, request: httpx.Request) -> httpx.Response:
+        """Como send(), por el cliente de streams; llamar a close_stream() al cerrar"""
+        response = await self.stream_client.send(request, stream=True)
+        self.streams_open += 1
+        return response
+
+    async def close_stream(self, response: httpx.Response):
+        await response.aclose()
+        self.streams_open -= 1
+
+    def stats(self) -> dict:
+        buckets = {str(bound): count for bound, count in zip(ACQUIRE_BUCKETS, self._acquire_buckets)}
+        buckets["+Inf"] = self._acquire_buckets[-1]
+        return {
+            "base_url": self.base_url,
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            "keepalive_expiry": self.keepalive_expiry,
+            "in_use": self.in_use,
+            "queued": self.queued,
+            "pool_timeouts": self.pool_timeouts,
+            "max_streams": self.max_streams,
+            "streams_open": self.streams_open,
+            "acquire_count": self._acquire_count,
+            "acquire_seconds_sum": round(self._acquire_sum, 6),
+            "acquire_seconds_buckets": buckets,
+            **self.guard.stats(),
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
+        await self.stream_client.aclose()
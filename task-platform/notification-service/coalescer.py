@@ -0,0 +1,103 @@
+"""Write coalescing for single /notify calls.
+
+Each /notify request hands its row to a flusher thread, which groups whatever
+arrives within NOTIFY_COALESCE_WINDOW_MS (up to NOTIFY_COALESCE_MAX_BATCH rows)
+into a single transaction. Ids are read after the flush, so callers still get
+the id of their notification without a refresh round-trip.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from database import SessionLocal
+from models import Notification
+from counters import increment_unread
+from pubsub import broker, notification_event
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_COALESCE_WINDOW_MS = float(os.getenv("NOTIFY_COALESCE_WINDOW_MS", "5"))
+NOTIFY_COALESCE_MAX_BATCH = int(os.getenv("NOTIFY_COALESCE_MAX_BATCH", "500"))
+
+
+class NotifyCoalescer:
+    def __init__(self, session_factory=SessionLocal, window_ms: float = NOTIFY_COALESCE_WINDOW_MS,
+                 max_batch: int = NOTIFY_COALESCE_MAX_BATCH):
+        self._session_factory = session_factory
+        self._window = window_ms / 1000.0
+        self._max_batch = max_batch
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._window > 0
+
+    def start(self):
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, name="notify-coalescer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, values: dict) -> Future:
+        """Queue one notification; the future resolves to its id once committed."""
+        future: Future = Future()
+        self._queue.put((values, future))
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self._window
+            stopping = False
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+            if stopping:
+                return
+
+    def _flush(self, batch: list[tuple[dict, Future]]):
+        db = self._session_factory()
+        try:
+            rows = [Notification(**values) for values, _ in batch]
+            db.add_all(rows)
+            db.flush()
+            ids = [row.id for row in rows]
+            db.execute(increment_unread([row.user_id for row in rows]))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.exception(f"Failed to write {len(batch)} coalesced notifications")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            db.close()
+        for (_, future), notif_id in zip(batch, ids):
+            future.set_result(notif_id)
+        broker.publish([notification_event(values, notif_id) for (values, _), notif_id in zip(batch, ids)])
+
+
+coalescer = NotifyCoalescer()
@@ -0,0 +1,39 @@
+"""Statements that keep notification_unread_counts in step with notifications.
+
+Each is executed in the transaction that inserts notifications or marks them
+read, so the counter commits or rolls back together with the rows it counts.
+"""
+from collections import Counter
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from models import Notification, UnreadCount
+
+
+def increment_unread(user_ids) -> object:
+    """One upsert adding the new notifications of every user in `user_ids`."""
+    counts = Counter(user_ids)
+    stmt = mysql_insert(UnreadCount).values(
+        [{"user_id": user_id, "unread": count} for user_id, count in counts.items()]
+    )
+    return stmt.on_duplicate_key_update(unread=UnreadCount.unread + stmt.inserted.unread)
+
+
+def decrement_unread(user_id: int, count: int) -> object:
+    return (
+        update(UnreadCount)
+        .where(UnreadCount.user_id == user_id)
+        .values(unread=func.greatest(UnreadCount.unread - count, 0))
+    )
+
+
+def backfill_unread() -> object:
+    """Recount every user from the notifications table (startup reconciliation)."""
+    counted = (
+        select(Notification.user_id, func.count().label("unread"))
+        .where(Notification.read == False)
+        .group_by(Notification.user_id)
+    )
+    stmt = mysql_insert(UnreadCount).from_select(["user_id", "unread"], counted)
+    return stmt.on_duplicate_key_update(unread=stmt.inserted.unread)
@@ -1,6 +1,17 @@
 from fastapi import FastAPI
-from database import engine, Base
+from fastapi.responses import PlainTextResponse
+from metrics import CONTENT_TYPE, MetricsMiddleware, render
+from tracing import TracingMiddleware, tracer
+from database import engine, Base, pool_status
+from security import token_cache
+from models import Notification, UnreadCount
+from counters import backfill_unread
+from sqlalchemy import inspect, select
 from routers.notifications import router as notifications_router
+from coalescer import coalescer
+from pubsub import broker
+from response_cache import response_cache
+from retention import purger
 import logging
 
 # Configure logging
@@ -8,9 +19,27 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Notification Service")
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
+# Create tables and add indexes missing from tables created by older versions
+def ensure_indexes():
+    inspector = inspect(engine)
+    existing = {ix["name"] for ix in inspector.get_indexes(Notification.__tablename__)}
+    for index in Notification.__table__.indexes:
+        if index.name not in existing:
+            index.create(bind=engine)
+
+# Fill the unread counters from existing notifications the first time they
+# are used; afterwards every write keeps them up to date.
+def ensure_unread_counts():
+    with engine.begin() as conn:
+        if conn.execute(select(UnreadCount.user_id).limit(1)).first() is None:
+            conn.execute(backfill_unread())
 
-# Create tables
 Base.metadata.create_all(bind=engine)
+ensure_indexes()
+ensure_unread_counts()
 
 app.include_router(notifications_router)
 
@@ -23,7 +52,50 @@ def health():
     """Health check endpoint for Kubernetes"""
     return {"status": "healthy", "service": "notification-service"}
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Request, database and threadpool metrics in Prometheus text format"""
+    return PlainTextResponse(render(), media_type=CONTENT_TYPE)
+
+@app.get("/metrics/tracing")
+async def tracing_metrics():
+    """Spans exported, dropped on a full queue and lost to exporter errors"""
+    return tracer.stats()
+
+@app.get("/metrics/db-pool")
+async def db_pool_metrics():
+    """Connection pool usage, for sizing DB_POOL_* against replica counts"""
+    return pool_status()
+
+@app.get("/metrics/token-cache")
+async def token_cache_metrics():
+    """Hit/miss counters of the verified-token cache"""
+    return token_cache.stats()
+
+@app.get("/metrics/response-cache")
+async def response_cache_metrics():
+    """Hit/miss/304 counters of the per-user response cache"""
+    return response_cache.stats()
+
+@app.get("/metrics/retention")
+async def retention_metrics():
+    """Rows purged and archived, purge lag and the last dry-run result"""
+    return purger.stats()
+
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
+    tracer.start("notification-service")
+    await broker.start()
+    response_cache.start()
+    coalescer.start()
+    purger.start()
     logger.info("Notification Service started")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    purger.stop()
+    coalescer.stop()
+    await broker.stop()
+    await response_cache.stop()
+    tracer.stop()
+
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Index
 from sqlalchemy.sql import func
 from database import Base
 
@@ -11,3 +11,25 @@ class Notification(Base):
     task_id = Column(Integer, nullable=True)
     read = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # Keyset pagination of GET /notifications: unread_only / since_minutes
+        # filters are range scans on the first index, the unfiltered listing
+        # walks the second one. Neither needs a filesort.
+        Index('ix_notifications_user_read_created', 'user_id', 'read', 'created_at', 'id'),
+        Index('ix_notifications_user_created', 'user_id', 'created_at', 'id'),
+        # Retention purge: oldest read / unread rows across all users
+        Index('ix_notifications_read_created', 'read', 'created_at'),
+    )
+
+
+class UnreadCount(Base):
+    """Unread notifications per user, kept in step with every write.
+
+    Updated in the same transaction as the notifications it counts (see
+    counters.py), so GET /notifications/unread-count is a primary-key lookup.
+    """
+    __tablename__ = 'notification_unread_counts'
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    unread = Column(Integer, nullable=False, default=0)
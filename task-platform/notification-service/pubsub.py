@@ -0,0 +1,181 @@
+"""In-process pub/sub for pushing new notifications to streaming clients.
+
+Writers (the /notify handlers and the coalescer thread) call
+``broker.publish(events)`` from any thread. Each connected client owns a small
+bounded queue registered under its user id; delivery to it is a dict lookup
+and a put_nowait on the event loop, so idle connections cost no more than
+their queue and socket.
+
+The backend decides how events reach the local subscribers:
+
+- ``local`` (default): delivered directly, only to clients of this process.
+  Only correct with a single replica: a client connected to another replica
+  never sees these events.
+- ``redis``: published to one Redis channel shared by all replicas; each
+  keeps a single subscription to it and fans events out to its own clients,
+  filtered by user id. This is what kubernetes/ deploys.
+
+Select it with NOTIFY_PUBSUB_BACKEND (``local`` or ``redis``) and REDIS_URL.
+"""
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_PUBSUB_BACKEND = os.getenv("NOTIFY_PUBSUB_BACKEND", "local")
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+NOTIFY_PUBSUB_CHANNEL = os.getenv("NOTIFY_PUBSUB_CHANNEL", "notifications")
+NOTIFY_STREAM_QUEUE_SIZE = int(os.getenv("NOTIFY_STREAM_QUEUE_SIZE", "100"))
+
+
+def notification_event(values: dict, notif_id: int | None = None) -> dict:
+    """Event for a notification that was just committed.
+
+    Rows written by /notify/batch have no id here (MySQL does not return the
+    ids of a multi-row INSERT); clients that need one refetch GET /notifications.
+    """
+    return {
+        "id": notif_id,
+        "user_id": values["user_id"],
+        "message": values["message"],
+        "task_id": values.get("task_id"),
+        "read": False,
+        "created_at": datetime.utcnow().isoformat(),
+    }
+
+
+class Subscription:
+    """Events for one connected client. ``lagged`` is set if its queue overflowed."""
+
+    def __init__(self, user_id: int, maxsize: int = NOTIFY_STREAM_QUEUE_SIZE):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.lagged = False
+
+
+class LocalBackend:
+    """Delivers events straight to the subscribers of this process."""
+
+    def __init__(self):
+        self._deliver = None
+
+    async def start(self, deliver):
+        self._deliver = deliver
+
+    async def stop(self):
+        pass
+
+    async def publish(self, events: list[dict]):
+        self._deliver(events)
+
+
+class RedisBackend:
+    """Shares events between replicas through a single Redis channel."""
+
+    def __init__(self, url: str = REDIS_URL, channel: str = NOTIFY_PUBSUB_CHANNEL):
+        self._url = url
+        self._channel = channel
+        self._redis = None
+        self._pubsub = None
+        self._reader: asyncio.Task | None = None
+
+    async def start(self, deliver):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(self._url)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self._channel)
+        self._reader = asyncio.create_task(self._read(deliver))
+
+    async def stop(self):
+        if self._reader:
+            self._reader.cancel()
+        if self._pubsub:
+            await self._pubsub.aclose()
+        if self._redis:
+            await self._redis.aclose()
+
+    async def publish(self, events: list[dict]):
+        await self._redis.publish(self._channel, json.dumps(events, default=str))
+
+    async def _read(self, deliver):
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    deliver(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Redis pub/sub reader failed, resubscribing")
+                await asyncio.sleep(1)
+
+
+def make_backend(name: str = NOTIFY_PUBSUB_BACKEND):
+    if name == "redis":
+        return RedisBackend()
+    if name == "local":
+        return LocalBackend()
+    raise ValueError(f"Unknown NOTIFY_PUBSUB_BACKEND: {name}")
+
+
+class NotificationBroker:
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._subscribers: dict[int, set[Subscription]] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def start(self):
+        if self._backend is None:
+            self._backend = make_backend()
+        self._loop = asyncio.get_running_loop()
+        await self._backend.start(self._deliver)
+
+    async def stop(self):
+        if self._loop is not None:
+            await self._backend.stop()
+            self._loop = None
+
+    def subscribe(self, user_id: int) -> Subscription:
+        sub = Subscription(user_id)
+        self._subscribers.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        subs = self._subscribers.get(sub.user_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[sub.user_id]
+
+    @property
+    def connections(self) -> int:
+        return sum(len(subs) for subs in self._subscribers.values())
+
+    def publish(self, events: list[dict]):
+        """Thread-safe; never blocks the writer and never raises into it."""
+        if self._loop is None or not events:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._backend.publish(events), self._loop)
+        future.add_done_callback(self._log_publish_error)
+
+    @staticmethod
+    def _log_publish_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Failed to publish notifications: {future.exception()}")
+
+    def _deliver(self, events: list[dict]):
+        # Runs on the event loop
+        for event in events:
+            for sub in self._subscribers.get(event["user_id"], ()):
+                try:
+                    sub.queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # A client this far behind is told to reconnect and refetch
+                    # instead of letting its backlog grow without bound.
+                    sub.lagged = True
+
+
+broker = NotificationBroker()
@@ -0,0 +1,192 @@
+"""Retention purge for the notifications table.
+
+A background thread deletes read notifications older than RETENTION_READ_DAYS
+and unread ones older than RETENTION_UNREAD_DAYS (0 disables either rule).
+It works in batches of RETENTION_BATCH_SIZE rows, one short transaction each,
+pausing RETENTION_BATCH_PAUSE seconds between batches so row locks and
+replication lag stay small. SKIP LOCKED lets several replicas run it at once.
+
+Deleting is opt-in: RETENTION_DRY_RUN defaults to true, which only counts
+and logs what would be purged (see /metrics/retention); set it to false to
+purge. With RETENTION_ARCHIVE_DIR set, each batch is appended to a
+gzip-compressed JSONL file per day before it is deleted (at-least-once: a
+batch whose delete fails is archived again on the next run). After each
+batch the cached notification lists and unread counts of its users are
+invalidated, like after any other write.
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select
+
+from counters import decrement_unread
+from database import SessionLocal
+from models import Notification
+from response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+RETENTION_READ_DAYS = int(os.getenv("RETENTION_READ_DAYS", "30"))
+RETENTION_UNREAD_DAYS = int(os.getenv("RETENTION_UNREAD_DAYS", "180"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.2"))
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "")
+RETENTION_DRY_RUN = os.getenv("RETENTION_DRY_RUN", "true").lower() in ("1", "true", "yes")
+
+
+class RetentionPurger:
+    def __init__(self, session_factory=SessionLocal):
+        self._session_factory = session_factory
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.purged = {"read": 0, "unread": 0}
+        self.archived = 0
+        self.last_run_at: datetime | None = None
+        self.last_run_seconds: float | None = None
+        self.last_dry_run: dict | None = None
+        # Age in seconds of the oldest row already past its cutoff, per rule
+        self.lag = {"read": 0.0, "unread": 0.0}
+
+    def rules(self) -> list[tuple[str, bool, int]]:
+        return [
+            (name, read, days)
+            for name, read, days in (("read", True, RETENTION_READ_DAYS), ("unread", False, RETENTION_UNREAD_DAYS))
+            if days > 0
+        ]
+
+    def start(self):
+        if not self.rules() or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention-purger", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Retention purge failed")
+            self._stop.wait(RETENTION_INTERVAL)
+
+    def run_once(self):
+        started = time.monotonic()
+        now = datetime.utcnow()
+        if RETENTION_DRY_RUN:
+            self.last_dry_run = {}
+        for name, read, days in self.rules():
+            cutoff = now - timedelta(days=days)
+            if RETENTION_DRY_RUN:
+                self.last_dry_run[name] = self._count(read, cutoff)
+            else:
+                while not self._stop.is_set() and self._purge_batch(name, read, cutoff) == RETENTION_BATCH_SIZE:
+                    self._stop.wait(RETENTION_BATCH_PAUSE)
+            self.lag[name] = self._lag(read, cutoff, now)
+        self.last_run_at = now
+        self.last_run_seconds = round(time.monotonic() - started, 3)
+        if RETENTION_DRY_RUN:
+            logger.info(f"Retention dry run, rows that would be purged: {self.last_dry_run}")
+
+    def _count(self, read: bool, cutoff: datetime) -> int:
+        db = self._session_factory()
+        try:
+            return db.scalar(
+                select(func.count()).select_from(Notification)
+                .where(Notification.read == read, Notification.created_at < cutoff)
+            )
+        finally:
+            db.close()
+
+    def _lag(self, read: bool, cutoff: datetime, now: datetime) -> float:
+        db = self._session_factory()
+        try:
+            oldest = db.scalar(
+                select(func.min(Notification.created_at))
+                .where(Notification.read == read, Notification.created_at < cutoff)
+            )
+        finally:
+            db.close()
+        return (now - oldest.replace(tzinfo=None)).total_seconds() if oldest else 0.0
+
+    def _purge_batch(self, name: str, read: bool, cutoff: datetime) -> int:
+        db = self._session_factory()
+        try:
+            rows = db.execute(
+                select(Notification)
+                .where(Notification.read == read, Notification.created_at < cutoff)
+                .order_by(Notification.created_at)
+                .limit(RETENTION_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+            ).scalars().all()
+            if not rows:
+                db.rollback()
+                return 0
+            if RETENTION_ARCHIVE_DIR:
+                self._archive(rows)
+            db.execute(
+                delete(Notification).where(Notification.id.in_([row.id for row in rows]))
+                .execution_options(synchronize_session=False)
+            )
+            if not read:
+                for user_id, count in Counter(row.user_id for row in rows).items():
+                    db.execute(decrement_unread(user_id, count))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        response_cache.invalidate_threadsafe("notifications", [row.user_id for row in rows])
+        self.purged[name] += len(rows)
+        return len(rows)
+
+    def _archive(self, rows: list[Notification]):
+        os.makedirs(RETENTION_ARCHIVE_DIR, exist_ok=True)
+        path = os.path.join(RETENTION_ARCHIVE_DIR, f"notifications-{datetime.utcnow():%Y%m%d}.jsonl.gz")
+        lines = "".join(
+            json.dumps({
+                "id": row.id,
+                "user_id": row.user_id,
+                "message": row.message,
+                "task_id": row.task_id,
+                "read": row.read,
+                "created_at": row.created_at.isoformat() if row.created_at else None,
+            }) + "\n"
+            for row in rows
+        )
+        # Each batch is its own gzip member; concatenated members are a valid gzip file
+        with open(path, "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="ab") as f:
+                f.write(lines.encode("utf-8"))
+            raw.flush()
+            # On disk before the rows are deleted
+            os.fsync(raw.fileno())
+        self.archived += len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "dry_run": RETENTION_DRY_RUN,
+            "read_days": RETENTION_READ_DAYS,
+            "unread_days": RETENTION_UNREAD_DAYS,
+            "purged": dict(self.purged),
+            "archived": self.archived,
+            "lag_seconds": dict(self.lag),
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_run_seconds": self.last_run_seconds,
+            "last_dry_run": self.last_dry_run,
+        }
+
+
+purger = RetentionPurger()
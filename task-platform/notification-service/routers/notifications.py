@@ -1,15 +1,43 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Path
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Path, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import insert, select, update, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
-from models import Notification
+from models import Notification, UnreadCount
+from counters import increment_unread, decrement_unread
 from security import verify_token
+from coalescer import coalescer
+from pubsub import broker, notification_event
+from response_cache import response_cache
 from pydantic import BaseModel
 from datetime import datetime
 from datetime import timedelta
 from typing import List
+import asyncio
+import base64
+import binascii
+import json
+import os
+
+NOTIFY_BATCH_CHUNK_SIZE = int(os.getenv("NOTIFY_BATCH_CHUNK_SIZE", "1000"))
+NOTIFY_STREAM_HEARTBEAT = float(os.getenv("NOTIFY_STREAM_HEARTBEAT", "15"))
+MARK_READ_CHUNK_SIZE = int(os.getenv("MARK_READ_CHUNK_SIZE", "1000"))
 
 router = APIRouter(prefix="", tags=["Notifications"])
 
+def encode_cursor(created_at: datetime, notif_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{notif_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, notif_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(notif_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 class NotifyIn(BaseModel):
     user_id: int
     message: str
@@ -23,48 +51,156 @@ class NotificationOut(BaseModel):
     read: bool
     created_at: datetime
 
+class NotifyBatchIn(BaseModel):
+    notifications: List[NotifyIn]
+
 @router.post("/notify")
-def notify(payload: NotifyIn, db: Session = Depends(get_db)):
+async def notify(payload: NotifyIn, db: AsyncSession = Depends(get_db)):
+    if coalescer.enabled:
+        # Grouped with concurrent /notify calls into a single commit
+        notif_id = await asyncio.wrap_future(coalescer.submit(payload.model_dump()))
+        await response_cache.invalidate("notifications", [payload.user_id])
+        return {"message": "Notification created", "id": notif_id}
     notif = Notification(user_id=payload.user_id, message=payload.message, task_id=payload.task_id)
     db.add(notif)
-    db.commit()
-    db.refresh(notif)
-    return {"message": "Notification created", "id": notif.id}
+    await db.flush()
+    notif_id = notif.id
+    await db.execute(increment_unread([payload.user_id]))
+    await db.commit()
+    await response_cache.invalidate("notifications", [payload.user_id])
+    broker.publish([notification_event(payload.model_dump(), notif_id)])
+    return {"message": "Notification created", "id": notif_id}
+
+@router.post("/notify/batch")
+async def notify_batch(payload: NotifyBatchIn, db: AsyncSession = Depends(get_db)):
+    # One multi-row INSERT per chunk and a single commit; chunks keep each
+    # statement well under max_allowed_packet.
+    rows = [n.model_dump() for n in payload.notifications]
+    for start in range(0, len(rows), NOTIFY_BATCH_CHUNK_SIZE):
+        chunk = rows[start:start + NOTIFY_BATCH_CHUNK_SIZE]
+        await db.execute(insert(Notification).values(chunk))
+        await db.execute(increment_unread([row["user_id"] for row in chunk]))
+    await db.commit()
+    await response_cache.invalidate("notifications", [row["user_id"] for row in rows])
+    broker.publish([notification_event(row) for row in rows])
+    return {"message": "Notifications created", "count": len(rows)}
 
 @router.get("/notifications", response_model=list[NotificationOut])
-def list_notifications(
+async def list_notifications(
+    request: Request,
     token: dict = Depends(verify_token),
     unread_only: bool = Query(False, description="If true, return only unread notifications"),
     since_minutes: int | None = Query(None, description="If provided, return notifications created within the last N minutes"),
-    db: Session = Depends(get_db),
+    limit: int = Query(50, ge=1, le=200, description="Maximum number of notifications to return"),
+    cursor: str | None = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    db: AsyncSession = Depends(get_db),
 ):
     x_user_id = token["user_id"]
-    q = db.query(Notification).filter(Notification.user_id == x_user_id)
+    if since_minutes is None:
+        # since_minutes results move with the clock, so only the others are cached
+        variant = {"unread_only": unread_only, "limit": limit, "cursor": cursor}
+        return await response_cache.respond(
+            request, "notifications", x_user_id, variant,
+            lambda: _list_notifications(db, x_user_id, unread_only, None, limit, cursor),
+        )
+    body, headers = await _list_notifications(db, x_user_id, unread_only, since_minutes, limit, cursor)
+    return JSONResponse(content=body, headers=headers)
+
+
+async def _list_notifications(db: AsyncSession, x_user_id: int, unread_only: bool,
+                              since_minutes: int | None, limit: int, cursor: str | None):
+    q = select(Notification).where(Notification.user_id == x_user_id)
     if unread_only:
-        q = q.filter(Notification.read == False)
+        q = q.where(Notification.read == False)
     if since_minutes is not None:
         cutoff = datetime.utcnow() - timedelta(minutes=since_minutes)
-        q = q.filter(Notification.created_at >= cutoff)
-    notes = q.order_by(Notification.created_at.desc()).all()
-    return notes
+        q = q.where(Notification.created_at >= cutoff)
+    if cursor is not None:
+        # Keyset pagination: continue strictly after the last (created_at, id) seen
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        q = q.where(or_(
+            Notification.created_at < cursor_created_at,
+            and_(Notification.created_at == cursor_created_at, Notification.id < cursor_id),
+        ))
+    q = q.order_by(Notification.created_at.desc(), Notification.id.desc()).limit(limit + 1)
+    notes = (await db.execute(q)).scalars().all()
+    headers = {}
+    if len(notes) > limit:
+        notes = notes[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(notes[-1].created_at, notes[-1].id)
+    body = jsonable_encoder([NotificationOut.model_validate(n, from_attributes=True) for n in notes])
+    return body, headers
+
+
+@router.get("/notifications/unread-count")
+async def unread_count(
+    request: Request,
+    token: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_db),
+):
+    x_user_id = token["user_id"]
+
+    # A primary-key lookup on the counter table, usually served from the
+    # response cache; the notifications table is never scanned here.
+    async def build():
+        unread = await db.scalar(select(UnreadCount.unread).where(UnreadCount.user_id == x_user_id))
+        return {"unread": unread or 0}, {}
+
+    return await response_cache.respond(request, "notifications", x_user_id, {"unread_count": True}, build)
+
+
+@router.get("/notifications/stream")
+async def stream_notifications(request: Request, token: dict = Depends(verify_token)):
+    """Server-Sent Events stream of the caller's new notifications."""
+    async def events():
+        sub = broker.subscribe(token["user_id"])
+        try:
+            # Open the stream immediately so proxies don't wait for the first event
+            yield ": connected\n\n"
+            while not sub.lagged:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), NOTIFY_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                event_id = f"id: {event['id']}\n" if event["id"] is not None else ""
+                yield f"{event_id}event: notification\ndata: {json.dumps(event)}\n\n"
+            if sub.lagged:
+                yield "event: reset\ndata: {}\n\n"
+        finally:
+            broker.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.patch("/notifications/{notif_id}/read", response_model=NotificationOut)
-def mark_notification_read(
+async def mark_notification_read(
     notif_id: int = Path(..., description="ID of the notification to mark read"),
     token: dict = Depends(verify_token),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     x_user_id = token["user_id"]
-    notif = db.query(Notification).filter(Notification.id == notif_id).first()
+    notif = await db.get(Notification, notif_id)
     if not notif:
         raise HTTPException(status_code=404, detail="Notification not found")
     if notif.user_id != x_user_id:
         raise HTTPException(status_code=403, detail="Not allowed to modify this notification")
-    notif.read = True
-    db.add(notif)
-    db.commit()
-    db.refresh(notif)
+    # Conditional UPDATE so concurrent calls decrement the counter only once
+    result = await db.execute(
+        update(Notification).where(Notification.id == notif_id, Notification.read == False).values(read=True)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        await db.execute(decrement_unread(x_user_id, 1))
+    await db.commit()
+    await response_cache.invalidate("notifications", [x_user_id])
+    await db.refresh(notif)
     return notif
 
 
@@ -73,21 +209,60 @@ class MarkReadIn(BaseModel):
 
 
 @router.post("/notifications/mark-read", response_model=list[NotificationOut])
-def mark_notifications_read_bulk(
+async def mark_notifications_read_bulk(
     payload: MarkReadIn,
     token: dict = Depends(verify_token),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     x_user_id = token["user_id"]
-    # Fetch notifications that match the provided ids and belong to the user
-    notes = db.query(Notification).filter(Notification.id.in_(payload.ids), Notification.user_id == x_user_id).all()
-    if not notes:
-        return []
-    for n in notes:
-        n.read = True
-        db.add(n)
-    db.commit()
-    # Refresh and return updated objects
-    for n in notes:
-        db.refresh(n)
+    ids = sorted(set(payload.ids))
+    notes = []
+    # One set-based UPDATE and one SELECT per chunk instead of a load, an
+    # UPDATE and a refresh per row; chunks keep the IN lists under max_allowed_packet.
+    for start in range(0, len(ids), MARK_READ_CHUNK_SIZE):
+        chunk = ids[start:start + MARK_READ_CHUNK_SIZE]
+        owned = and_(Notification.id.in_(chunk), Notification.user_id == x_user_id)
+        result = await db.execute(
+            update(Notification).where(owned, Notification.read == False).values(read=True)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            await db.execute(decrement_unread(x_user_id, result.rowcount))
+        notes.extend((await db.execute(
+            select(Notification).where(owned).order_by(Notification.id)
+        )).scalars().all())
+    await db.commit()
+    if notes:
+        await response_cache.invalidate("notifications", [x_user_id])
     return notes
+
+
+@router.post("/notifications/mark-all-read")
+async def mark_all_notifications_read(
+    before: datetime | None = Query(None, description="If provided, only notifications created at or before this time"),
+    token: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_db),
+):
+    x_user_id = token["user_id"]
+    stmt = update(Notification).where(Notification.user_id == x_user_id, Notification.read == False)
+    if before is not None:
+        stmt = stmt.where(Notification.created_at <= before)
+    # Chunked with UPDATE ... LIMIT and a commit per chunk so a user with a
+    # huge backlog never holds row locks for one long transaction.
+    stmt = (
+        stmt.values(read=True)
+        .with_dialect_options(mysql_limit=MARK_READ_CHUNK_SIZE)
+        .execution_options(synchronize_session=False)
+    )
+    updated = 0
+    while True:
+        result = await db.execute(stmt)
+        if result.rowcount:
+            await db.execute(decrement_unread(x_user_id, result.rowcount))
+        await db.commit()
+        updated += result.rowcount
+        if result.rowcount < MARK_READ_CHUNK_SIZE:
+            break
+    if updated:
+        await response_cache.invalidate("notifications", [x_user_id])
+    return {"message": "Notifications marked read", "count": updated}
@@ -1,19 +1,48 @@
 import jwt
 import os
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from token_cache import INTERNAL_AUTH_SECRET, INTERNAL_IDENTITY_HEADER, TokenCache, verify_identity
 
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
+# Accept the gateway's signed X-Internal-Identity header instead of re-decoding the JWT
+TRUSTED_GATEWAY = os.getenv("TRUSTED_GATEWAY", "false").lower() in ("1", "true", "yes")
 
-security = HTTPBearer()
+if TRUSTED_GATEWAY and not INTERNAL_AUTH_SECRET:
+    raise RuntimeError("TRUSTED_GATEWAY requires INTERNAL_AUTH_SECRET")
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+# The bearer token is optional in trusted-gateway mode, checked below otherwise
+security = HTTPBearer(auto_error=False)
+token_cache = TokenCache()
+
+
+def _claims_to_token(claims: dict) -> dict:
+    return {"user_id": int(claims["sub"]), "email": claims.get("email"), "role": claims.get("role", "user")}
+
+
+async def verify_token(request: Request, credentials: HTTPAuthorizationCredentials | None = Depends(security)):
     """
     Verify JWT token from Authorization header.
     Returns the decoded token payload (including user_id from 'sub' claim).
+    Runs on the event loop: decoding an HS256 token is cheaper than a threadpool hop.
     """
+    if TRUSTED_GATEWAY:
+        identity = request.headers.get(INTERNAL_IDENTITY_HEADER)
+        if identity is not None:
+            claims = verify_identity(identity)
+            if claims is None or claims.get("sub") is None:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Invalid internal identity",
+                )
+            return _claims_to_token(claims)
+    if credentials is None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authenticated")
     token = credentials.credentials
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
@@ -22,7 +51,9 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid token: missing user ID",
             )
-        return {"user_id": int(user_id), "email": payload.get("email"), "role": payload.get("role", "user")}
+        result = _claims_to_token(payload)
+        token_cache.put(token, result, payload.get("exp"))
+        return result
     except jwt.ExpiredSignatureError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
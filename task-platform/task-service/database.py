@@ -1,8 +1,13 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
+from db_pool import InstrumentedAsyncQueuePool, InstrumentedQueuePool, pool_options
+from metrics import instrument_engine
+from tracing import trace_engine
 
 # Load .env when running locally
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
@@ -12,17 +17,90 @@ DB_PASSWORD = os.getenv('DB_PASSWORD', 'admin123')
 DB_HOST = os.getenv('DB_HOST', 'mysql')
 DB_PORT = os.getenv('DB_PORT', '3306')
 DB_NAME = os.getenv('DB_NAME', 'tasks_db')
+# sync: pymysql, each query runs in the threadpool; async: aiomysql on the event loop
+DB_MODE = os.getenv('DB_MODE', 'sync')
 
 DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+ASYNC_DATABASE_URL = f"mysql+aiomysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+# The sync engine is always available: table creation and the outbox dispatcher use it
+engine = create_engine(DATABASE_URL, poolclass=InstrumentedQueuePool, **pool_options())
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrument_engine(engine)
+trace_engine(engine)
 Base = declarative_base()
 
+if DB_MODE == 'async':
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=InstrumentedAsyncQueuePool, **pool_options())
+    instrument_engine(async_engine.sync_engine)
+    trace_engine(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+elif DB_MODE != 'sync':
+    raise ValueError(f"DB_MODE must be 'sync' or 'async', got {DB_MODE!r}")
+
+
+def pool_status() -> dict:
+    """Pool metrics for every engine this process uses."""
+    status = {'sync': InstrumentedQueuePool.metrics.snapshot(engine.pool)}
+    if DB_MODE == 'async':
+        status['async'] = InstrumentedAsyncQueuePool.metrics.snapshot(async_engine.sync_engine.pool)
+    return status
+
+
+class SyncSessionAdapter:
+    """AsyncSession-compatible wrapper over a sync Session.
+
+    Lets the async routers run unchanged in sync mode: every call that talks
+    to the database is handed to the threadpool.
+    """
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, params=None):
+        return await run_in_threadpool(self.sync_session.execute, statement, params)
+
+    async def scalar(self, statement, params=None):
+        return await run_in_threadpool(self.sync_session.scalar, statement, params)
+
+    async def get(self, entity, ident):
+        return await run_in_threadpool(self.sync_session.get, entity, ident)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def refresh(self, instance):
+        await run_in_threadpool(self.sync_session.refresh, instance)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
 # Dependency for FastAPI
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+async def get_db():
+    if DB_MODE == 'async':
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        # Same as the async sessions: attributes stay loaded after commit, so
+        # reading them never issues a blocking lazy load on the event loop
+        db = SyncSessionAdapter(SessionLocal(expire_on_commit=False))
+        try:
+            yield db
+        finally:
+            await db.close()
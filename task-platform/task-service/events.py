@@ -0,0 +1,207 @@
+"""Task event stream and its fan-out into notifications.
+
+Every task write records created / status_changed / reassigned / deleted
+events with record_events(), in the same transaction as the change. The
+fan-out thread drains them in batches, turns each into the notifications of
+the users it concerns and writes those to the notification outbox (see
+outbox.py), deleting the events in the same transaction. The request that
+made the change never waits for any of this. The traceparent of a sampled
+request travels with its events and notifications, so the delivery to
+notification-service shows up in the same trace.
+
+status_changed events are held for TASK_EVENT_COALESCE_SECONDS. When one
+comes due, the later flips of the same task are drained with it and the
+whole run becomes a single notification from the first status to the last,
+or none if the task ended where it started.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert
+
+from database import SessionLocal
+from models import NotificationOutbox, TaskEvent
+from outbox import dispatcher
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+TASK_EVENT_BATCH_SIZE = int(os.getenv("TASK_EVENT_BATCH_SIZE", "500"))
+TASK_EVENT_POLL_INTERVAL = float(os.getenv("TASK_EVENT_POLL_INTERVAL", "1.0"))
+TASK_EVENT_COALESCE_SECONDS = float(os.getenv("TASK_EVENT_COALESCE_SECONDS", "2"))
+
+CREATED = "created"
+STATUS_CHANGED = "status_changed"
+REASSIGNED = "reassigned"
+DELETED = "deleted"
+
+
+def record_events(events: list[dict]) -> object:
+    """One multi-row INSERT of task events.
+
+    Each event has event, task_id, actor_id, title, created_by and assigned_to,
+    plus previous_assigned_to (reassigned) or status and previous_status
+    (status_changed).
+    """
+    now = datetime.utcnow()
+    held = now + timedelta(seconds=TASK_EVENT_COALESCE_SECONDS)
+    traceparent = tracer.current_traceparent(sampled_only=True)
+    return insert(TaskEvent).values([
+        {
+            "previous_assigned_to": None, "status": None, "previous_status": None,
+            **event,
+            "next_attempt_at": held if event["event"] == STATUS_CHANGED else now,
+            "traceparent": traceparent,
+        }
+        for event in events
+    ])
+
+
+def coalesce(events: list[TaskEvent]) -> list[TaskEvent]:
+    """Merge the status_changed events of each task into its first one, in id order."""
+    merged: list[TaskEvent] = []
+    first_flip: dict[int, TaskEvent] = {}
+    for event in events:
+        if event.event != STATUS_CHANGED:
+            merged.append(event)
+            continue
+        first = first_flip.get(event.task_id)
+        if first is None:
+            first_flip[event.task_id] = event
+            merged.append(event)
+        else:
+            first.status = event.status
+            first.actor_id = event.actor_id
+            first.title = event.title
+            first.traceparent = event.traceparent or first.traceparent
+    return [
+        event for event in merged
+        if event.event != STATUS_CHANGED or event.status != event.previous_status
+    ]
+
+
+def notifications_for(event: TaskEvent) -> list[dict]:
+    """Outbox rows for one event; the user who made the change is never notified."""
+    if event.event == CREATED:
+        recipients = [(event.assigned_to, f"Nueva tarea asignada: {event.title}")]
+    elif event.event == STATUS_CHANGED:
+        recipients = [(event.created_by, f"Tarea '{event.title}': {event.previous_status} -> {event.status}")]
+    elif event.event == REASSIGNED:
+        recipients = [
+            (event.assigned_to, f"Tarea reasignada: {event.title}"),
+            (event.previous_assigned_to, f"Tarea '{event.title}' reasignada a otro usuario"),
+        ]
+    elif event.event == DELETED:
+        recipients = [(event.assigned_to, f"Tarea eliminada: {event.title}")]
+    else:
+        logger.warning(f"Unknown task event {event.event!r} for task {event.task_id}")
+        recipients = []
+    return [
+        # Deleted tasks no longer exist, so their notification carries no task_id
+        {
+            "user_id": user_id,
+            "message": message[:500],
+            "task_id": None if event.event == DELETED else event.task_id,
+            "traceparent": event.traceparent,
+        }
+        for user_id, message in recipients
+        if user_id is not None and user_id != event.actor_id
+    ]
+
+
+class EventFanout:
+    def __init__(self, session_factory=SessionLocal):
+        self._session_factory = session_factory
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.events = 0
+        self.coalesced = 0
+        self.notifications = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="task-event-fanout", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wakeup(self):
+        """Ask the worker to drain now instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.drain_once()
+            except Exception:
+                logger.exception("Task event fan-out failed")
+                processed = 0
+            # A full batch means there is probably more backlog: keep draining.
+            if processed < TASK_EVENT_BATCH_SIZE:
+                self._wakeup.wait(TASK_EVENT_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def drain_once(self) -> int:
+        """Fan out one batch of due events. Returns the number of events processed."""
+        db = self._session_factory()
+        try:
+            # SKIP LOCKED lets several replicas drain the same table
+            events = (
+                db.query(TaskEvent)
+                .filter(TaskEvent.next_attempt_at <= datetime.utcnow())
+                .order_by(TaskEvent.id)
+                .limit(TASK_EVENT_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            if not events:
+                db.rollback()
+                return 0
+            flipped = {event.task_id for event in events if event.event == STATUS_CHANGED}
+            if flipped:
+                # Flips still inside their window join the run they belong to
+                events += (
+                    db.query(TaskEvent)
+                    .filter(
+                        TaskEvent.task_id.in_(flipped),
+                        TaskEvent.event == STATUS_CHANGED,
+                        TaskEvent.id.notin_([event.id for event in events]),
+                    )
+                    .with_for_update(skip_locked=True)
+                    .all()
+                )
+                events.sort(key=lambda event: event.id)
+            ids = [event.id for event in events]
+            # Detach first: coalesce() edits the merged events in memory only
+            db.expunge_all()
+            merged = coalesce(events)
+            rows = [row for event in merged for row in notifications_for(event)]
+            if rows:
+                db.execute(insert(NotificationOutbox).values(rows))
+            db.execute(
+                delete(TaskEvent).where(TaskEvent.id.in_(ids)).execution_options(synchronize_session=False)
+            )
+            db.commit()
+        finally:
+            db.close()
+        self.events += len(ids)
+        self.coalesced += len(ids) - len(merged)
+        self.notifications += len(rows)
+        if rows:
+            dispatcher.wakeup()
+        return len(ids)
+
+    def stats(self) -> dict:
+        return {"events": self.events, "coalesced": self.coalesced, "notifications": self.notifications}
+
+
+fanout = EventFanout()
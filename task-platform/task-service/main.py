@@ -1,6 +1,16 @@
 from fastapi import FastAPI
-from database import engine, Base
+from fastapi.responses import PlainTextResponse
+from metrics import CONTENT_TYPE, MetricsMiddleware, render
+from tracing import TracingMiddleware, tracer
+from database import engine, Base, pool_status
+from models import NotificationOutbox, Task, TaskEvent
+from security import token_cache
 from routers.tasks import router as tasks_router
+from outbox import dispatcher
+from events import fanout
+from response_cache import response_cache
+from rollups import reconciler
+from sqlalchemy import inspect, text
 import logging
 
 # Configure logging
@@ -8,9 +18,40 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Task Service")
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
+# Index names an older version created that models.py no longer declares
+OBSOLETE_TASK_INDEXES = {"ix_tasks_created_by_created"}
+
+# Create tables and add indexes missing from tables created by older versions
+def ensure_indexes():
+    inspector = inspect(engine)
+    existing = {ix["name"] for ix in inspector.get_indexes(Task.__tablename__)}
+    for index in Task.__table__.indexes:
+        if index.name not in existing:
+            index.create(bind=engine)
+    # Replaced by an index of the same prefix that also carries the keyset's id
+    for name in OBSOLETE_TASK_INDEXES & existing:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP INDEX {name} ON {Task.__tablename__}"))
+
+# Add nullable columns missing from tables created by older versions
+def ensure_columns():
+    inspector = inspect(engine)
+    for model in (Task, TaskEvent, NotificationOutbox):
+        existing = {col["name"] for col in inspector.get_columns(model.__tablename__)}
+        for column in model.__table__.columns:
+            if column.name not in existing and column.nullable:
+                with engine.begin() as conn:
+                    conn.execute(text(
+                        f"ALTER TABLE {model.__tablename__} ADD COLUMN {column.name} "
+                        f"{column.type.compile(engine.dialect)} NULL"
+                    ))
 
-# Create tables
 Base.metadata.create_all(bind=engine)
+ensure_columns()
+ensure_indexes()
 
 app.include_router(tasks_router)
 
@@ -23,6 +64,59 @@ def health():
     """Health check endpoint for Kubernetes"""
     return {"status": "healthy", "service": "task-service"}
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Request, database and threadpool metrics in Prometheus text format"""
+    return PlainTextResponse(render(), media_type=CONTENT_TYPE)
+
+@app.get("/metrics/tracing")
+async def tracing_metrics():
+    """Spans exported, dropped on a full queue and lost to exporter errors"""
+    return tracer.stats()
+
+@app.get("/metrics/db-pool")
+async def db_pool_metrics():
+    """Connection pool usage, for sizing DB_POOL_* against replica counts"""
+    return pool_status()
+
+@app.get("/metrics/token-cache")
+async def token_cache_metrics():
+    """Hit/miss counters of the verified-token cache"""
+    return token_cache.stats()
+
+@app.get("/metrics/response-cache")
+async def response_cache_metrics():
+    """Hit/miss/304 counters of the per-user response cache"""
+    return response_cache.stats()
+
+@app.get("/metrics/task-events")
+async def task_event_metrics():
+    """Task events fanned out, coalesced away and notifications produced"""
+    return fanout.stats()
+
+@app.get("/metrics/outbox")
+async def outbox_metrics():
+    """Outbox deliveries, failures, dead letters and the pending backlog"""
+    return dispatcher.stats()
+
+@app.get("/metrics/rollups")
+async def rollup_metrics():
+    """Runs and corrected groups of the dashboard rollup reconciliation"""
+    return reconciler.stats()
+
 @app.on_event("startup")
 def startup_event():
-    logger.info("Task Service started")
\ No newline at end of file
+    tracer.start("task-service")
+    response_cache.start()
+    dispatcher.start()
+    fanout.start()
+    reconciler.start()
+    logger.info("Task Service started")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    reconciler.stop()
+    fanout.stop()
+    dispatcher.stop()
+    await response_cache.stop()
+    tracer.stop()
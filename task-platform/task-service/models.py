@@ -1,14 +1,112 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, Index
 from sqlalchemy.sql import func
+from datetime import datetime
 from database import Base
 
+DEFAULT_STATUS = 'pending'
+
 class Task(Base):
     __tablename__ = 'tasks'
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(200), nullable=False)
     description = Column(Text, nullable=True)
-    status = Column(String(50), default='pending')
+    status = Column(String(50), default=DEFAULT_STATUS)
     assigned_to = Column(Integer, nullable=False)
     created_by = Column(Integer, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Marker of the POST /tasks/bulk request that inserted the row, to read it back
+    bulk_id = Column(String(32), nullable=True)
+
+    __table_args__ = (
+        Index('ix_tasks_bulk_id', 'bulk_id'),
+        # Keyset pagination of GET /tasks/assigned and GET /tasks/created: per
+        # owner, a status filter is a range scan on the (owner, status, ...)
+        # index and the other listings walk the (owner, created_at, id) one,
+        # in (created_at, id) order, so none of them needs a filesort.
+        Index('ix_tasks_assigned_status_created', 'assigned_to', 'status', 'created_at', 'id'),
+        Index('ix_tasks_assigned_created', 'assigned_to', 'created_at', 'id'),
+        Index('ix_tasks_created_by_status_created', 'created_by', 'status', 'created_at', 'id'),
+        Index('ix_tasks_created_by_created_id', 'created_by', 'created_at', 'id'),
+        # GET /tasks/search; ignored outside MySQL
+        Index('ft_tasks_title_description', 'title', 'description', mysql_prefix='FULLTEXT'),
+    )
+
+
+class NotificationOutbox(Base):
+    """Pending notification committed in the same transaction as its task.
+
+    Rows are drained by the dispatcher in outbox.py and deleted once
+    notification-service has accepted them, or kept with failed_at set once
+    delivery is given up.
+    """
+    __tablename__ = 'notification_outbox'
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    message = Column(String(500), nullable=False)
+    task_id = Column(Integer, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    last_error = Column(String(500), nullable=True)
+    # Set when notification-service rejected the row (400/422); kept for inspection, never retried
+    failed_at = Column(DateTime, nullable=True)
+    # W3C trace context of the request that caused the notification, if sampled
+    traceparent = Column(String(55), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class TaskEvent(Base):
+    """Change to a task, committed in the same transaction as the change.
+
+    Drained by the fan-out in events.py, which turns events into outbox
+    notifications and deletes them.
+    """
+    __tablename__ = 'task_events'
+
+    id = Column(Integer, primary_key=True, index=True)
+    event = Column(String(20), nullable=False)
+    task_id = Column(Integer, nullable=False, index=True)
+    actor_id = Column(Integer, nullable=False)
+    title = Column(String(200), nullable=False)
+    created_by = Column(Integer, nullable=False)
+    assigned_to = Column(Integer, nullable=False)
+    previous_assigned_to = Column(Integer, nullable=True)
+    status = Column(String(50), nullable=True)
+    previous_status = Column(String(50), nullable=True)
+    # status_changed events wait out the coalescing window before fan-out
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    traceparent = Column(String(55), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class TaskStatusCount(Base):
+    """Current number of tasks per (creator, assignee, status).
+
+    Kept in step by every task write (see rollups.py) and periodically
+    recounted from tasks, so the dashboard reads groups, not tasks.
+    """
+    __tablename__ = 'task_status_counts'
+
+    created_by = Column(Integer, primary_key=True, autoincrement=False)
+    assigned_to = Column(Integer, primary_key=True, autoincrement=False)
+    status = Column(String(50), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class TaskStatusDaily(Base):
+    """Tasks that entered each status per UTC day and creator (throughput).
+
+    Append-only history: creation counts as entering the initial status.
+    """
+    __tablename__ = 'task_status_daily'
+
+    created_by = Column(Integer, primary_key=True, autoincrement=False)
+    day = Column(Date, primary_key=True)
+    status = Column(String(50), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Admin dashboard: every creator over a range of days
+        Index('ix_task_status_daily_day', 'day'),
+    )
@@ -0,0 +1,278 @@
+"""Background dispatcher for the notification outbox.
+
+The task event fan-out (events.py) writes the notifications of committed task
+changes here; this worker delivers pending rows to notification-service's /notify/batch
+endpoint, one request per batch, and keeps retrying with exponential backoff
+while the service is unavailable. Delivery is at-least-once: a row is only
+deleted after notification-service accepted it.
+
+A batch is claimed by pushing its next_attempt_at OUTBOX_CLAIM_SECONDS ahead
+in a short transaction; the HTTP call runs with no transaction open, and a
+replica that dies mid-delivery leaves the rows to be retried once the claim
+expires.
+
+Transient failures (connection errors, timeouts, 5xx, 408, 429...) are
+retried forever, with backoff capped at OUTBOX_MAX_BACKOFF: an outage delays
+notifications but never drops them. Only a 400/422, a payload the service
+will reject every time, dead-letters rows (failed_at set, never retried), and
+a rejected batch is bisected first so that only the offending rows are
+dead-lettered. The size and age of the pending backlog are exported to
+Prometheus (outbox_pending_rows, outbox_oldest_pending_seconds,
+outbox_max_pending_attempts) to alert on a stuck outbox.
+
+Each delivery continues the trace of the first row that carries a
+traceparent; the other traced requests in the batch are attached as links.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, update
+
+import requests
+
+from database import SessionLocal
+from metrics import Counter, Gauge
+from models import NotificationOutbox
+from tracing import CLIENT, TRACEPARENT_HEADER, parse_traceparent, tracer
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_SERVICE_URL = os.getenv("NOTIFICATION_SERVICE_URL", "http://notification-service:8003")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))
+OUTBOX_BASE_BACKOFF = float(os.getenv("OUTBOX_BASE_BACKOFF", "1.0"))
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "300"))
+OUTBOX_HTTP_TIMEOUT = float(os.getenv("OUTBOX_HTTP_TIMEOUT", "5"))
+OUTBOX_CLAIM_SECONDS = float(os.getenv("OUTBOX_CLAIM_SECONDS", "60"))
+OUTBOX_STATS_INTERVAL = float(os.getenv("OUTBOX_STATS_INTERVAL", "15"))
+
+# Validation errors: the same payload would be refused on every retry
+REJECTED_STATUSES = (400, 422)
+
+# next_attempt_at of dead-lettered rows: outside every due-row range scan
+DEAD_LETTER_AT = datetime(9999, 12, 31)
+
+DELIVERED = Counter("outbox_delivered_total", "Outbox rows accepted by notification-service")
+DEAD_LETTERED = Counter("outbox_dead_lettered_total", "Outbox rows rejected by notification-service")
+DELIVERY_FAILURES = Counter("outbox_delivery_failures_total", "Outbox rows whose delivery attempt failed transiently")
+
+
+class DeliveryRejected(Exception):
+    """notification-service refused the batch itself; retrying cannot help."""
+
+
+def backoff_delay(attempts: int) -> float:
+    """Exponential backoff with jitter, capped at OUTBOX_MAX_BACKOFF seconds."""
+    # Rows are retried forever: bound the exponent so 2 ** n stays a small float
+    delay = min(OUTBOX_MAX_BACKOFF, OUTBOX_BASE_BACKOFF * (2 ** min(max(attempts - 1, 0), 32)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class OutboxDispatcher:
+    def __init__(self, session_factory=SessionLocal):
+        self._session_factory = session_factory
+        self._http = requests.Session()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.delivered = 0
+        self.dead_lettered = 0
+        self.failed_attempts = 0
+        # Pending (not dead-lettered) rows, refreshed every OUTBOX_STATS_INTERVAL
+        self.backlog = {"pending": 0, "oldest_pending_seconds": 0.0, "max_attempts": 0}
+        self._backlog_refreshed = 0.0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._http.close()
+
+    def wakeup(self):
+        """Ask the worker to drain now instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.drain_once()
+            except Exception:
+                logger.exception("Outbox drain failed")
+                processed = 0
+            if time.monotonic() - self._backlog_refreshed >= OUTBOX_STATS_INTERVAL:
+                try:
+                    self.refresh_backlog()
+                except Exception:
+                    logger.exception("Outbox backlog query failed")
+                self._backlog_refreshed = time.monotonic()
+            # A full batch means there is probably more backlog: keep draining.
+            if processed < OUTBOX_BATCH_SIZE:
+                self._wakeup.wait(OUTBOX_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def drain_once(self) -> int:
+        """Deliver one batch of due rows. Returns the number of rows processed."""
+        rows = self._claim()
+        if not rows:
+            return 0
+        self._deliver(rows)
+        return len(rows)
+
+    def _deliver(self, rows: list[NotificationOutbox]):
+        try:
+            self._send(rows)
+        except DeliveryRejected as e:
+            if len(rows) == 1:
+                self._dead_letter(rows, str(e))
+                return
+            # One invalid row rejects the whole batch: bisect down to the culprits
+            middle = len(rows) // 2
+            self._deliver(rows[:middle])
+            self._deliver(rows[middle:])
+        except requests.RequestException as e:
+            self._reschedule(rows, str(e))
+        else:
+            self._delete(rows)
+
+    def _claim(self) -> list[NotificationOutbox]:
+        db = self._session_factory()
+        try:
+            # SKIP LOCKED lets several replicas claim batches at once without
+            # delivering a row twice; the locks last only until the claim commits.
+            rows = (
+                db.query(NotificationOutbox)
+                .filter(NotificationOutbox.next_attempt_at <= datetime.utcnow())
+                .order_by(NotificationOutbox.id)
+                .limit(OUTBOX_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            if not rows:
+                db.rollback()
+                return []
+            db.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id.in_([row.id for row in rows]))
+                .values(next_attempt_at=datetime.utcnow() + timedelta(seconds=OUTBOX_CLAIM_SECONDS))
+                .execution_options(synchronize_session=False)
+            )
+            # Detached rows keep their loaded values after the commit
+            db.expunge_all()
+            db.commit()
+            return rows
+        finally:
+            db.close()
+
+    def _delete(self, rows: list[NotificationOutbox]):
+        db = self._session_factory()
+        try:
+            db.execute(
+                delete(NotificationOutbox).where(NotificationOutbox.id.in_([row.id for row in rows]))
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        finally:
+            db.close()
+        self.delivered += len(rows)
+        DELIVERED.inc(amount=len(rows))
+
+    def _send(self, rows: list[NotificationOutbox]):
+        payload = {
+            "notifications": [
+                {"user_id": row.user_id, "message": row.message, "task_id": row.task_id}
+                for row in rows
+            ]
+        }
+        traceparents = dict.fromkeys(row.traceparent for row in rows if row.traceparent)
+        contexts = [context for context in map(parse_traceparent, traceparents) if context]
+        if not contexts:
+            self._post(payload, {})
+            return
+        with tracer.span("POST /notify/batch", CLIENT, parent=contexts[0], links=contexts[1:]) as span:
+            span.set_attribute("outbox.rows", len(rows))
+            self._post(payload, {TRACEPARENT_HEADER: span.context.traceparent})
+
+    def _post(self, payload: dict, headers: dict):
+        response = self._http.post(
+            f"{NOTIFICATION_SERVICE_URL}/notify/batch", json=payload, headers=headers, timeout=OUTBOX_HTTP_TIMEOUT
+        )
+        if response.status_code in REJECTED_STATUSES:
+            raise DeliveryRejected(f"HTTP {response.status_code}: {response.text[:200]}")
+        response.raise_for_status()
+
+    def _reschedule(self, rows: list[NotificationOutbox], error: str):
+        now = datetime.utcnow()
+        changes = [
+            {"id": row.id, "attempts": row.attempts + 1, "last_error": error[:500],
+             "next_attempt_at": now + timedelta(seconds=backoff_delay(row.attempts + 1))}
+            for row in rows
+        ]
+        self._update(changes)
+        self.failed_attempts += len(rows)
+        DELIVERY_FAILURES.inc(amount=len(rows))
+        logger.warning(f"Notification delivery failed for {len(rows)} outbox rows, retrying later: {error}")
+
+    def _dead_letter(self, rows: list[NotificationOutbox], error: str):
+        now = datetime.utcnow()
+        changes = [
+            {"id": row.id, "attempts": row.attempts + 1, "next_attempt_at": DEAD_LETTER_AT,
+             "failed_at": now, "last_error": error[:500]}
+            for row in rows
+        ]
+        self._update(changes)
+        self.dead_lettered += len(rows)
+        DEAD_LETTERED.inc(amount=len(rows))
+        logger.error(f"notification-service rejected outbox rows {[row.id for row in rows]}: {error}")
+
+    def _update(self, changes: list[dict]):
+        db = self._session_factory()
+        try:
+            # Executemany UPDATE by primary key
+            db.execute(update(NotificationOutbox), changes)
+            db.commit()
+        finally:
+            db.close()
+
+    def refresh_backlog(self):
+        db = self._session_factory()
+        try:
+            pending, oldest, max_attempts = (
+                db.query(func.count(NotificationOutbox.id), func.min(NotificationOutbox.created_at),
+                         func.max(NotificationOutbox.attempts))
+                .filter(NotificationOutbox.failed_at.is_(None))
+                .one()
+            )
+        finally:
+            db.close()
+        age = 0.0
+        if oldest is not None:
+            oldest = oldest.astimezone(timezone.utc).replace(tzinfo=None) if oldest.tzinfo else oldest
+            age = max((datetime.utcnow() - oldest).total_seconds(), 0.0)
+        self.backlog = {"pending": pending, "oldest_pending_seconds": round(age, 1),
+                        "max_attempts": max_attempts or 0}
+
+    def stats(self) -> dict:
+        return {"delivered": self.delivered, "dead_lettered": self.dead_lettered,
+                "failed_attempts": self.failed_attempts, **self.backlog}
+
+
+dispatcher = OutboxDispatcher()
+
+Gauge("outbox_pending_rows", "Outbox rows not yet delivered or dead-lettered",
+      collect=lambda: {(): dispatcher.backlog["pending"]})
+Gauge("outbox_oldest_pending_seconds", "Age of the oldest undelivered outbox row",
+      collect=lambda: {(): dispatcher.backlog["oldest_pending_seconds"]})
+Gauge("outbox_max_pending_attempts", "Most failed attempts of any undelivered outbox row",
+      collect=lambda: {(): dispatcher.backlog["max_attempts"]})
@@ -0,0 +1,198 @@
+"""Per-user read-through cache for list endpoints, with ETags.
+
+Entries are keyed by (namespace, user id, user version, query variant). A
+write bumps the user's version for that namespace, so every cached variant of
+that user becomes unreachable at once while other users keep their entries.
+A read that raced with the write stores its result under the old version,
+where it is never served.
+
+Each entry keeps the serialized body and its ETag, so a matching
+If-None-Match is answered with 304 straight from the cache.
+
+Background threads invalidate through invalidate_threadsafe(), which runs the
+bump on the event loop the cache was started on.
+
+RESPONSE_CACHE_BACKEND selects the backend: ``local`` (in-process LRU; only
+correct with a single replica, since other replicas never see its version
+bumps), ``redis`` (shared by replicas, what kubernetes/ deploys) or ``off``.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import Request, Response
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "local")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class LocalBackend:
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE):
+        self._maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._versions: dict[str, int] = {}
+
+    async def version(self, scope: str) -> int:
+        return self._versions.get(scope, 0)
+
+    async def bump(self, scopes: list[str]):
+        for scope in scopes:
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    async def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: int):
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    async def aclose(self):
+        pass
+
+
+class RedisBackend:
+    def __init__(self, url: str = REDIS_URL):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url, decode_responses=True)
+
+    async def version(self, scope: str) -> int:
+        return int(await self._redis.get(f"v:{scope}") or 0)
+
+    async def bump(self, scopes: list[str]):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for scope in scopes:
+                pipe.incr(f"v:{scope}")
+            await pipe.execute()
+
+    async def get(self, key: str) -> str | None:
+        return await self._redis.get(key)
+
+    async def set(self, key: str, value: str, ttl: int):
+        await self._redis.set(key, value, ex=ttl)
+
+    async def aclose(self):
+        await self._redis.aclose()
+
+
+def make_backend(name: str = RESPONSE_CACHE_BACKEND):
+    if name == "local":
+        return LocalBackend()
+    if name == "redis":
+        return RedisBackend()
+    if name == "off":
+        return None
+    raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {name}")
+
+
+class ResponseCache:
+    def __init__(self, backend=None, ttl: int = RESPONSE_CACHE_TTL):
+        self._backend = backend
+        self._ttl = ttl
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def start(self):
+        if self._backend is None:
+            self._backend = make_backend()
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        if self._backend is not None:
+            await self._backend.aclose()
+
+    @staticmethod
+    def _scope(namespace: str, user_id: int) -> str:
+        return f"rc:{namespace}:{user_id}"
+
+    async def invalidate(self, namespace: str, user_ids):
+        """Drop every cached variant of these users; a cache outage must not fail the write."""
+        if self._backend is None:
+            return
+        scopes = [self._scope(namespace, user_id) for user_id in set(user_ids)]
+        if not scopes:
+            return
+        try:
+            await self._backend.bump(scopes)
+        except Exception as e:
+            logger.error(f"Response cache invalidation failed: {e}")
+
+    def invalidate_threadsafe(self, namespace: str, user_ids, timeout: float = 5.0):
+        """invalidate() from a worker thread; waits so the caller's commit is visible before it returns."""
+        if self._loop is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self.invalidate(namespace, user_ids), self._loop)
+        try:
+            future.result(timeout)
+        except Exception as e:
+            logger.error(f"Response cache invalidation failed: {e}")
+
+    async def respond(self, request: Request, namespace: str, user_id: int, variant: dict, build) -> Response:
+        """Serve from cache or call `build()` -> (jsonable body, extra headers) and cache it."""
+        key = None
+        entry = None
+        if self._backend is not None:
+            try:
+                scope = self._scope(namespace, user_id)
+                variant_key = hashlib.sha1(json.dumps(variant, sort_keys=True).encode()).hexdigest()
+                key = f"{scope}:{await self._backend.version(scope)}:{variant_key}"
+                cached = await self._backend.get(key)
+                entry = json.loads(cached) if cached is not None else None
+            except Exception as e:
+                logger.error(f"Response cache read failed: {e}")
+                key = None
+        if entry is None:
+            self.misses += 1
+            body, headers = await build()
+            content = json.dumps(body, separators=(",", ":"))
+            entry = {
+                "etag": f'"{hashlib.sha1(content.encode()).hexdigest()}"',
+                "body": content,
+                "headers": headers,
+            }
+            if key is not None:
+                try:
+                    await self._backend.set(key, json.dumps(entry), self._ttl)
+                except Exception as e:
+                    logger.error(f"Response cache write failed: {e}")
+        else:
+            self.hits += 1
+        headers = {"ETag": entry["etag"], "Cache-Control": "private, no-cache", **entry["headers"]}
+        if etag_matches(request.headers.get("If-None-Match"), entry["etag"]):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "not_modified": self.not_modified}
+
+
+response_cache = ResponseCache()
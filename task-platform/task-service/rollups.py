@@ -0,0 +1,180 @@
+"""Dashboard rollups: task counts per (creator, assignee, status) and daily throughput.
+
+rollup_statements() builds the upserts for a set of changes (rollup_move() for
+a task leaving one group for another); the routers
+execute them in the transaction that changes the tasks, so the rollups commit
+or roll back together with the rows they count. Negative deltas only ever
+update an existing row, clamped at zero: a decrement with nothing to
+decrement is drift, left for the reconciler rather than stored as -1.
+
+RollupReconciler recounts one creator at a time from the tasks table and
+rewrites that creator's task_status_counts rows, correcting any drift. The
+recount is a locking read, so writes to that creator's tasks wait for it
+instead of slipping between the count and the rewrite. Daily throughput is
+history and is not reconciled.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import delete, func, select, union, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from database import SessionLocal
+from models import DEFAULT_STATUS, Task, TaskStatusCount, TaskStatusDaily
+
+logger = logging.getLogger(__name__)
+
+TASK_ROLLUP_RECONCILE_INTERVAL = float(os.getenv("TASK_ROLLUP_RECONCILE_INTERVAL", "3600"))
+TASK_ROLLUP_RECONCILE_PAUSE = float(os.getenv("TASK_ROLLUP_RECONCILE_PAUSE", "0.05"))
+
+
+def rollup_move(source: tuple, target: tuple) -> Counter:
+    """Deltas of one task moving from the source group to the target group.
+
+    Built by subtraction so that a move onto the same group cancels out; a
+    dict literal with two equal keys would keep only the +1."""
+    deltas: Counter = Counter()
+    deltas[source] -= 1
+    deltas[target] += 1
+    return deltas
+
+
+def rollup_statements(deltas: Counter, transitions: Counter | None = None) -> list:
+    """Upserts for count deltas keyed (created_by, assigned_to, status) and
+    status entries keyed (created_by, status), the latter counted for today."""
+    statements = []
+    # Rows written before status had a default may hold NULL
+    counts: Counter = Counter()
+    for (created_by, assigned_to, status), n in deltas.items():
+        counts[(created_by, assigned_to, status or DEFAULT_STATUS)] += n
+    increments = {key: n for key, n in counts.items() if n > 0}
+    if increments:
+        stmt = mysql_insert(TaskStatusCount).values([
+            {"created_by": created_by, "assigned_to": assigned_to, "status": status, "count": n}
+            for (created_by, assigned_to, status), n in increments.items()
+        ])
+        statements.append(stmt.on_duplicate_key_update(count=TaskStatusCount.count + stmt.inserted["count"]))
+    for (created_by, assigned_to, status), n in counts.items():
+        if n < 0:
+            statements.append(
+                update(TaskStatusCount)
+                .where(
+                    TaskStatusCount.created_by == created_by,
+                    TaskStatusCount.assigned_to == assigned_to,
+                    TaskStatusCount.status == status,
+                )
+                .values(count=func.greatest(TaskStatusCount.count + n, 0))
+            )
+    # Daily throughput only counts entries into a status
+    transitions = {key: n for key, n in (transitions or {}).items() if n > 0}
+    if transitions:
+        day = datetime.utcnow().date()
+        stmt = mysql_insert(TaskStatusDaily).values([
+            {"created_by": created_by, "day": day, "status": status, "count": n}
+            for (created_by, status), n in transitions.items()
+        ])
+        statements.append(stmt.on_duplicate_key_update(count=TaskStatusDaily.count + stmt.inserted["count"]))
+    return statements
+
+
+class RollupReconciler:
+    def __init__(self, session_factory=SessionLocal):
+        self._session_factory = session_factory
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.runs = 0
+        self.corrected_groups = 0
+        self.last_run_at: datetime | None = None
+        self.last_run_seconds: float | None = None
+
+    def start(self):
+        if TASK_ROLLUP_RECONCILE_INTERVAL <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rollup-reconciler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        # The first pass also fills the rollups of a deployment that predates them
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Rollup reconciliation failed")
+            self._stop.wait(TASK_ROLLUP_RECONCILE_INTERVAL)
+
+    def run_once(self):
+        started = time.monotonic()
+        db = self._session_factory()
+        try:
+            creators = db.execute(union(
+                select(Task.created_by).distinct(),
+                select(TaskStatusCount.created_by).distinct(),
+            )).scalars().all()
+        finally:
+            db.close()
+        for created_by in creators:
+            if self._stop.is_set():
+                return
+            self.corrected_groups += self.reconcile_creator(created_by)
+            self._stop.wait(TASK_ROLLUP_RECONCILE_PAUSE)
+        self.runs += 1
+        self.last_run_at = datetime.utcnow()
+        self.last_run_seconds = round(time.monotonic() - started, 3)
+
+    def reconcile_creator(self, created_by: int) -> int:
+        """Rewrite one creator's counts from tasks; returns the groups that were wrong."""
+        status = func.coalesce(Task.status, DEFAULT_STATUS)
+        db = self._session_factory()
+        try:
+            actual = {
+                (assigned_to, task_status): n
+                for assigned_to, task_status, n in db.execute(
+                    select(Task.assigned_to, status, func.count())
+                    .where(Task.created_by == created_by)
+                    .group_by(Task.assigned_to, status)
+                    .with_for_update(read=True)
+                )
+            }
+            stored = {
+                (row.assigned_to, row.status): row.count
+                for row in db.execute(
+                    select(TaskStatusCount).where(TaskStatusCount.created_by == created_by).with_for_update()
+                ).scalars()
+            }
+            wrong = {key for key in actual.keys() | stored.keys() if actual.get(key, 0) != stored.get(key, 0)}
+            if wrong:
+                db.execute(delete(TaskStatusCount).where(TaskStatusCount.created_by == created_by))
+                if actual:
+                    db.execute(mysql_insert(TaskStatusCount).values([
+                        {"created_by": created_by, "assigned_to": assigned_to, "status": task_status, "count": n}
+                        for (assigned_to, task_status), n in actual.items()
+                    ]))
+                logger.info(f"Corrected {len(wrong)} task rollup groups of creator {created_by}")
+            db.commit()
+            return len(wrong)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "corrected_groups": self.corrected_groups,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_run_seconds": self.last_run_seconds,
+        }
+
+
+reconciler = RollupReconciler()
@@ -1,16 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import insert, select, update, func, or_, and_
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
-from models import Task
+from models import DEFAULT_STATUS, Task, TaskStatusCount, TaskStatusDaily
 from security import verify_token
-from pydantic import BaseModel
-import requests
-from datetime import datetime
+from events import CREATED, DELETED, REASSIGNED, STATUS_CHANGED, fanout, record_events
+from response_cache import response_cache
+from rollups import rollup_move, rollup_statements
+from pydantic import BaseModel, model_validator
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Literal
+import base64
+import binascii
 import os
-import logging
+import re
+import uuid
 
-logger = logging.getLogger(__name__)
-NOTIFICATION_SERVICE_URL = os.getenv("NOTIFICATION_SERVICE_URL", "http://notification-service:8003")
+# Rows per multi-row INSERT/UPDATE; keeps each statement under max_allowed_packet
+TASK_BULK_CHUNK_SIZE = int(os.getenv("TASK_BULK_CHUNK_SIZE", "1000"))
+TASK_BULK_MAX_ITEMS = int(os.getenv("TASK_BULK_MAX_ITEMS", "10000"))
+TASK_SEARCH_MAX_TERMS = int(os.getenv("TASK_SEARCH_MAX_TERMS", "8"))
+TASK_SEARCH_MAX_OFFSET = int(os.getenv("TASK_SEARCH_MAX_OFFSET", "1000"))
 
 router = APIRouter(prefix="/tasks", tags=["Tasks"])
 
@@ -20,11 +34,63 @@ def require_role(token: dict, allowed_roles: list[str]):
     if role not in allowed_roles:
         raise HTTPException(status_code=403, detail="Insufficient role")
 
+def encode_cursor(created_at: datetime, task_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{task_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, task_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(task_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def boolean_query(text: str) -> str:
+    """Keywords -> FULLTEXT boolean query: every term required, each as a prefix.
+
+    Operators typed by the user are dropped, so the query is always valid.
+    """
+    terms = re.findall(r"\w+", text)[:TASK_SEARCH_MAX_TERMS]
+    return " ".join(f"+{term}*" for term in terms)
+
 class TaskCreate(BaseModel):
     title: str
     description: str | None = None
     assigned_to: int
 
+class TaskTemplate(BaseModel):
+    title: str
+    description: str | None = None
+
+class TaskBulkCreate(BaseModel):
+    # Either explicit tasks, or one template copied to every assigned_to
+    tasks: list[TaskCreate] | None = None
+    template: TaskTemplate | None = None
+    assigned_to: list[int] | None = None
+
+    @model_validator(mode="after")
+    def one_form(self):
+        if (self.tasks is None) == (self.template is None):
+            raise ValueError("Provide either tasks or template")
+        if self.template is not None and not self.assigned_to:
+            raise ValueError("template requires a non-empty assigned_to list")
+        if self.tasks is not None and self.assigned_to is not None:
+            raise ValueError("assigned_to is only used with template")
+        return self
+
+    def expand(self) -> list[TaskCreate]:
+        if self.tasks is not None:
+            return self.tasks
+        return [
+            TaskCreate(title=self.template.title, description=self.template.description, assigned_to=user_id)
+            for user_id in self.assigned_to
+        ]
+
+class TaskReassign(BaseModel):
+    task_ids: list[int]
+    assigned_to: int
+
 class TaskOut(BaseModel):
     id: int
     title: str
@@ -34,8 +100,11 @@ class TaskOut(BaseModel):
     created_by: int
     created_at: datetime
 
+class TaskSearchHit(TaskOut):
+    score: float
+
 @router.post("/", response_model=TaskOut)
-def create_task(task: TaskCreate, token: dict = Depends(verify_token), db: Session = Depends(get_db)):
+async def create_task(task: TaskCreate, token: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
     # Only manager/admin can crear o reasignar tareas
     require_role(token, ["manager", "admin"])
     x_user_id = token["user_id"]
@@ -46,57 +115,342 @@ def create_task(task: TaskCreate, token: dict = Depends(verify_token), db: Sessi
         created_by=x_user_id,
     )
     db.add(db_task)
-    db.commit()
-    db.refresh(db_task)
-    # Notify assigned user via Notification Service
-    try:
-        notif_payload = {
-            "user_id": db_task.assigned_to,
-            "message": f"Nueva tarea asignada: {db_task.title}",
-            "task_id": db_task.id,
-        }
-        response = requests.post(f"{NOTIFICATION_SERVICE_URL}/notify", json=notif_payload, timeout=2)
-        response.raise_for_status()
-        logger.info(f"Notification sent for task {db_task.id}")
-    except Exception as e:
-        # avoid failing task creation if notification fails
-        logger.warning(f"Failed to send notification for task {db_task.id}: {str(e)}")
+    await db.flush()  # assigns db_task.id for the event
+    # The event is recorded in the same transaction and fanned out to
+    # notifications in the background, so task creation never waits on
+    # notification-service.
+    await db.execute(record_events([_event(CREATED, db_task, x_user_id)]))
+    for stmt in rollup_statements(
+        Counter({(x_user_id, db_task.assigned_to, db_task.status): 1}),
+        Counter({(x_user_id, db_task.status): 1}),
+    ):
+        await db.execute(stmt)
+    await db.commit()
+    await response_cache.invalidate("assigned", [db_task.assigned_to])
+    await db.refresh(db_task)
+    fanout.wakeup()
     return db_task
 
+@router.post("/bulk", response_model=list[TaskOut])
+async def create_tasks_bulk(payload: TaskBulkCreate, token: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    require_role(token, ["manager", "admin"])
+    tasks = payload.expand()
+    if len(tasks) > TASK_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {TASK_BULK_MAX_ITEMS} tasks per request")
+    if not tasks:
+        return []
+    x_user_id = token["user_id"]
+    # One multi-row INSERT per chunk for the tasks and one for their events,
+    # all in a single transaction. The rows carry a per-request marker and are
+    # read back by it: the ids of a multi-row INSERT are only a consecutive
+    # block with auto_increment_increment = 1, which Galera and group
+    # replication do not guarantee.
+    bulk_id = uuid.uuid4().hex
+    for start in range(0, len(tasks), TASK_BULK_CHUNK_SIZE):
+        chunk = tasks[start:start + TASK_BULK_CHUNK_SIZE]
+        await db.execute(insert(Task).values([
+            {"title": t.title, "description": t.description, "status": DEFAULT_STATUS,
+             "assigned_to": t.assigned_to, "created_by": x_user_id, "bulk_id": bulk_id}
+            for t in chunk
+        ]))
+    created = (await db.execute(select(Task).where(Task.bulk_id == bulk_id).order_by(Task.id))).scalars().all()
+    for start in range(0, len(created), TASK_BULK_CHUNK_SIZE):
+        await db.execute(record_events([
+            {"event": CREATED, "task_id": task.id, "actor_id": x_user_id, "title": task.title,
+             "created_by": x_user_id, "assigned_to": task.assigned_to, "status": DEFAULT_STATUS}
+            for task in created[start:start + TASK_BULK_CHUNK_SIZE]
+        ]))
+    for stmt in rollup_statements(
+        Counter((x_user_id, t.assigned_to, DEFAULT_STATUS) for t in tasks),
+        Counter({(x_user_id, DEFAULT_STATUS): len(tasks)}),
+    ):
+        await db.execute(stmt)
+    await db.commit()
+    await response_cache.invalidate("assigned", [t.assigned_to for t in tasks])
+    fanout.wakeup()
+    return created
+
+@router.post("/reassign")
+async def reassign_tasks(payload: TaskReassign, token: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    require_role(token, ["manager", "admin"])
+    task_ids = list(dict.fromkeys(payload.task_ids))
+    if len(task_ids) > TASK_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {TASK_BULK_MAX_ITEMS} tasks per request")
+    new_assignee = payload.assigned_to
+    moved: list[tuple[int, str, int]] = []  # (id, title, previous assignee)
+    found: set[int] = set()
+    deltas: Counter = Counter()
+    for start in range(0, len(task_ids), TASK_BULK_CHUNK_SIZE):
+        chunk = task_ids[start:start + TASK_BULK_CHUNK_SIZE]
+        # Lock the chunk so the previous assignees read here are the ones replaced
+        rows = (await db.execute(
+            select(Task.id, Task.title, Task.assigned_to, Task.created_by, Task.status)
+            .where(Task.id.in_(chunk)).with_for_update()
+        )).all()
+        found.update(row.id for row in rows)
+        chunk_moved = [(row.id, row.title, row.assigned_to) for row in rows if row.assigned_to != new_assignee]
+        if not chunk_moved:
+            continue
+        for row in rows:
+            if row.assigned_to != new_assignee:
+                deltas[(row.created_by, row.assigned_to, row.status)] -= 1
+                deltas[(row.created_by, new_assignee, row.status)] += 1
+        await db.execute(
+            update(Task).where(Task.id.in_([task_id for task_id, _, _ in chunk_moved]))
+            .values(assigned_to=new_assignee)
+            .execution_options(synchronize_session=False)
+        )
+        await db.execute(record_events([
+            {"event": REASSIGNED, "task_id": row.id, "actor_id": token["user_id"], "title": row.title,
+             "created_by": row.created_by, "assigned_to": new_assignee,
+             "previous_assigned_to": row.assigned_to, "status": row.status}
+            for row in rows if row.assigned_to != new_assignee
+        ]))
+        moved.extend(chunk_moved)
+    for stmt in rollup_statements(deltas):
+        await db.execute(stmt)
+    await db.commit()
+    if moved:
+        await response_cache.invalidate("assigned", [new_assignee, *(previous for _, _, previous in moved)])
+        fanout.wakeup()
+    return {
+        "message": "Tasks reassigned",
+        "assigned_to": new_assignee,
+        "reassigned": [task_id for task_id, _, _ in moved],
+        "not_found": [task_id for task_id in task_ids if task_id not in found],
+    }
+
 @router.get("/assigned", response_model=list[TaskOut])
-def list_assigned(token: dict = Depends(verify_token), db: Session = Depends(get_db)):
+async def list_assigned(
+    request: Request,
+    token: dict = Depends(verify_token),
+    status: str | None = Query(None, description="Only tasks in this status"),
+    created_by: int | None = Query(None, description="Only tasks created by this user"),
+    created_from: datetime | None = Query(None, description="Created at or after this instant"),
+    created_to: datetime | None = Query(None, description="Created strictly before this instant"),
+    sort: Literal["-created_at", "created_at"] = Query("-created_at", description="Newest first (default) or oldest first"),
+    limit: int = Query(50, ge=1, le=200, description="Maximum number of tasks to return"),
+    cursor: str | None = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    db: AsyncSession = Depends(get_db),
+):
     # Return tasks assigned to the requesting user
     x_user_id = token["user_id"]
-    tasks = db.query(Task).filter(Task.assigned_to == x_user_id).all()
-    return tasks
+    filters = {
+        "status": status, "created_by": created_by,
+        "created_from": created_from, "created_to": created_to,
+    }
+    variant = {**jsonable_encoder(filters), "sort": sort, "limit": limit, "cursor": cursor}
+    return await response_cache.respond(
+        request, "assigned", x_user_id, variant,
+        lambda: _list_tasks(db, Task.assigned_to == x_user_id, filters, sort, limit, cursor),
+    )
+
+@router.get("/created", response_model=list[TaskOut])
+async def list_created(
+    token: dict = Depends(verify_token),
+    status: str | None = Query(None, description="Only tasks in this status"),
+    assigned_to: int | None = Query(None, description="Only tasks assigned to this user"),
+    created_from: datetime | None = Query(None, description="Created at or after this instant"),
+    created_to: datetime | None = Query(None, description="Created strictly before this instant"),
+    sort: Literal["-created_at", "created_at"] = Query("-created_at", description="Newest first (default) or oldest first"),
+    limit: int = Query(50, ge=1, le=200, description="Maximum number of tasks to return"),
+    cursor: str | None = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    db: AsyncSession = Depends(get_db),
+):
+    # Tasks the requesting manager created. Not cached: status changes are made
+    # by the assignee and only invalidate the assignee's lists.
+    require_role(token, ["manager", "admin"])
+    filters = {
+        "status": status, "assigned_to": assigned_to,
+        "created_from": created_from, "created_to": created_to,
+    }
+    body, headers = await _list_tasks(db, Task.created_by == token["user_id"], filters, sort, limit, cursor)
+    return JSONResponse(content=body, headers=headers)
+
+
+async def _list_tasks(db: AsyncSession, owner, filters: dict, sort: str, limit: int, cursor: str | None):
+    # The owner's slice of a composite index in models.py serves the listing in
+    # (created_at, id) order: (owner, status, created_at, id) with a status
+    # filter, (owner, created_at, id) otherwise, so there is never a filesort.
+    # The other filters (assigned_to on /created, created_by on /assigned) are
+    # not in the index: they are checked on the rows walked in index order,
+    # so a selective one reads more rows per page.
+    q = select(Task).where(owner)
+    for column in ("status", "created_by", "assigned_to"):
+        if filters.get(column) is not None:
+            q = q.where(getattr(Task, column) == filters[column])
+    if filters["created_from"] is not None:
+        q = q.where(Task.created_at >= filters["created_from"])
+    if filters["created_to"] is not None:
+        q = q.where(Task.created_at < filters["created_to"])
+    descending = sort.startswith("-")
+    if cursor is not None:
+        # Keyset pagination: continue strictly after the last (created_at, id) seen
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        if descending:
+            q = q.where(or_(
+                Task.created_at < cursor_created_at,
+                and_(Task.created_at == cursor_created_at, Task.id < cursor_id),
+            ))
+        else:
+            q = q.where(or_(
+                Task.created_at > cursor_created_at,
+                and_(Task.created_at == cursor_created_at, Task.id > cursor_id),
+            ))
+    if descending:
+        q = q.order_by(Task.created_at.desc(), Task.id.desc())
+    else:
+        q = q.order_by(Task.created_at, Task.id)
+    tasks = (await db.execute(q.limit(limit + 1))).scalars().all()
+    headers = {}
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(tasks[-1].created_at, tasks[-1].id)
+    body = jsonable_encoder([TaskOut.model_validate(t, from_attributes=True) for t in tasks])
+    return body, headers
+
+@router.get("/search", response_model=list[TaskSearchHit])
+async def search_tasks(
+    q: str = Query(..., min_length=1, description="Keywords; each one matches words starting with it"),
+    status: str | None = Query(None, description="Only tasks in this status"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of results to return"),
+    offset: int = Query(0, ge=0, description="Results to skip; the next page's value comes in X-Next-Offset"),
+    token: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_db),
+):
+    # Served by the FULLTEXT index on (title, description); results are ranked
+    # by relevance, so pages are offsets into the ranking and only the first
+    # TASK_SEARCH_MAX_OFFSET results are reachable.
+    if offset > TASK_SEARCH_MAX_OFFSET:
+        raise HTTPException(status_code=400, detail=f"offset must be at most {TASK_SEARCH_MAX_OFFSET}")
+    against = boolean_query(q)
+    if not against:
+        return JSONResponse(content=[])
+    relevance = match(Task.title, Task.description, against=against).in_boolean_mode()
+    query = select(Task, relevance.label("score")).where(relevance)
+    # Visible tasks: the caller's own and those they created; admins see all
+    if token.get("role") != "admin":
+        query = query.where(or_(Task.assigned_to == token["user_id"], Task.created_by == token["user_id"]))
+    if status is not None:
+        query = query.where(Task.status == status)
+    query = query.order_by(relevance.desc(), Task.id.desc()).offset(offset).limit(limit + 1)
+    rows = (await db.execute(query)).all()
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Offset"] = str(offset + limit)
+    body = jsonable_encoder([
+        TaskSearchHit(**TaskOut.model_validate(task, from_attributes=True).model_dump(), score=score)
+        for task, score in rows
+    ])
+    return JSONResponse(content=body, headers=headers)
+
+@router.get("/stats")
+async def task_stats(
+    days: int = Query(30, ge=1, le=366, description="Days of throughput history, today included"),
+    token: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_db),
+):
+    # Read from the rollup tables, so the cost follows the number of groups,
+    # not of tasks. Managers see the tasks they created; admins see all.
+    require_role(token, ["manager", "admin"])
+    counts = select(TaskStatusCount).where(TaskStatusCount.count > 0)
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    daily = select(TaskStatusDaily.day, TaskStatusDaily.status, func.sum(TaskStatusDaily.count)).where(TaskStatusDaily.day >= since)
+    if token.get("role") != "admin":
+        counts = counts.where(TaskStatusCount.created_by == token["user_id"])
+        daily = daily.where(TaskStatusDaily.created_by == token["user_id"])
+    rows = (await db.execute(counts)).scalars().all()
+    by_assignee: Counter = Counter()
+    by_creator: Counter = Counter()
+    for row in rows:
+        by_assignee[(row.assigned_to, row.status)] += row.count
+        by_creator[(row.created_by, row.status)] += row.count
+    throughput = (await db.execute(
+        daily.group_by(TaskStatusDaily.day, TaskStatusDaily.status).order_by(TaskStatusDaily.day)
+    )).all()
+    return {
+        "by_assignee": [
+            {"assigned_to": assigned_to, "status": status, "count": n}
+            for (assigned_to, status), n in sorted(by_assignee.items())
+        ],
+        "by_creator": [
+            {"created_by": created_by, "status": status, "count": n}
+            for (created_by, status), n in sorted(by_creator.items())
+        ],
+        "throughput": [
+            {"day": day.isoformat(), "status": status, "count": int(n)}
+            for day, status, n in throughput
+        ],
+    }
+
+def _event(event: str, task: Task, actor_id: int, **changes) -> dict:
+    return {
+        "event": event, "task_id": task.id, "actor_id": actor_id, "title": task.title,
+        "created_by": task.created_by, "assigned_to": task.assigned_to, "status": task.status,
+        **changes,
+    }
+
+async def _locked_task(db: AsyncSession, task_id: int) -> Task | None:
+    # Row lock: the status/assignee read here is the one the rollup delta replaces
+    return (await db.execute(select(Task).where(Task.id == task_id).with_for_update())).scalars().first()
 
 @router.patch("/{task_id}/status", response_model=TaskOut)
-def update_status(task_id: int, status: str, token: dict = Depends(verify_token), db: Session = Depends(get_db)):
+async def update_status(task_id: int, status: str, token: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
     x_user_id = token["user_id"]
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await _locked_task(db, task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     # Only assigned user can update status
     if task.assigned_to != x_user_id:
         raise HTTPException(status_code=403, detail="Not allowed to update status")
+    if task.status != status:
+        for stmt in rollup_statements(
+            rollup_move((task.created_by, task.assigned_to, task.status),
+                        (task.created_by, task.assigned_to, status)),
+            Counter({(task.created_by, status): 1}),
+        ):
+            await db.execute(stmt)
+        await db.execute(record_events([
+            _event(STATUS_CHANGED, task, x_user_id, status=status, previous_status=task.status)
+        ]))
+    previous_status = task.status
     task.status = status
-    db.commit()
-    db.refresh(task)
+    await db.commit()
+    await response_cache.invalidate("assigned", [task.assigned_to])
+    await db.refresh(task)
+    if previous_status != status:
+        fanout.wakeup()
     return task
 
 @router.delete("/{task_id}")
-def delete_or_reassign(task_id: int, assigned_to: int | None = None, token: dict = Depends(verify_token), db: Session = Depends(get_db)):
+async def delete_or_reassign(task_id: int, assigned_to: int | None = None, token: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
     # Only manager/admin can borrar o reasignar
     require_role(token, ["manager", "admin"])
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await _locked_task(db, task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
+    previous_assignee = task.assigned_to
     if assigned_to is not None:
+        if assigned_to != previous_assignee:
+            for stmt in rollup_statements(rollup_move((task.created_by, previous_assignee, task.status),
+                                                      (task.created_by, assigned_to, task.status))):
+                await db.execute(stmt)
+            await db.execute(record_events([
+                _event(REASSIGNED, task, token["user_id"], assigned_to=assigned_to, previous_assigned_to=previous_assignee)
+            ]))
         task.assigned_to = assigned_to
-        db.commit()
-        db.refresh(task)
+        await db.commit()
+        await response_cache.invalidate("assigned", [previous_assignee, assigned_to])
+        await db.refresh(task)
+        fanout.wakeup()
         return {"message": "Task reassigned", "task_id": task.id}
     else:
-        db.delete(task)
-        db.commit()
+        for stmt in rollup_statements(Counter({(task.created_by, previous_assignee, task.status): -1})):
+            await db.execute(stmt)
+        await db.execute(record_events([_event(DELETED, task, token["user_id"])]))
+        await db.delete(task)
+        await db.commit()
+        await response_cache.invalidate("assigned", [previous_assignee])
+        fanout.wakeup()
         return {"message": "Task deleted", "task_id": task_id}
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The service imports its modules flat (from models import ...), as in the image
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,69 @@
+from events import CREATED, DELETED, REASSIGNED, STATUS_CHANGED, coalesce, notifications_for
+from models import TaskEvent
+
+_ids = iter(range(1, 10_000))
+
+
+def event(kind, task_id=1, **fields):
+    values = dict(id=next(_ids), event=kind, task_id=task_id, actor_id=10, title="Informe",
+                  created_by=1, assigned_to=2, previous_assigned_to=None, status=None,
+                  previous_status=None, traceparent=None)
+    values.update(fields)
+    return TaskEvent(**values)
+
+
+def flip(previous_status, status, task_id=1, **fields):
+    return event(STATUS_CHANGED, task_id, previous_status=previous_status, status=status, **fields)
+
+
+def test_flips_of_one_task_merge_into_first_to_last():
+    first = flip("pending", "in_progress")
+    merged = coalesce([first, flip("in_progress", "review", actor_id=11),
+                       flip("review", "done", actor_id=12, title="Informe final")])
+    assert merged == [first]
+    assert (first.previous_status, first.status) == ("pending", "done")
+    assert (first.actor_id, first.title) == (12, "Informe final")
+
+
+def test_flips_back_to_the_start_cancel_out():
+    assert coalesce([flip("pending", "done"), flip("done", "pending")]) == []
+
+
+def test_tasks_coalesce_independently():
+    a1, b1 = flip("pending", "done", task_id=1), flip("pending", "in_progress", task_id=2)
+    merged = coalesce([a1, b1, flip("done", "pending", task_id=1), flip("in_progress", "done", task_id=2)])
+    assert merged == [b1]
+    assert b1.status == "done"
+
+
+def test_other_events_pass_through_in_order():
+    created, reassigned, deleted = event(CREATED), event(REASSIGNED, previous_assigned_to=3), event(DELETED)
+    first = flip("pending", "done")
+    assert coalesce([created, first, reassigned, flip("done", "review"), deleted]) == [
+        created, first, reassigned, deleted,
+    ]
+
+
+def test_merged_flip_keeps_the_latest_traceparent():
+    first = flip("pending", "in_progress", traceparent="00-a-1-01")
+    coalesce([first, flip("in_progress", "done"), flip("done", "review", traceparent="00-b-2-01")])
+    assert first.traceparent == "00-b-2-01"
+    coalesce([first, flip("review", "done")])
+    assert first.traceparent == "00-b-2-01"
+
+
+def test_the_actor_is_never_notified():
+    assert notifications_for(event(CREATED, actor_id=2)) == []
+    assert [n["user_id"] for n in notifications_for(flip("pending", "done", actor_id=2))] == [1]
+
+
+def test_reassignment_notifies_both_assignees():
+    rows = notifications_for(event(REASSIGNED, assigned_to=3, previous_assigned_to=2))
+    assert [row["user_id"] for row in rows] == [3, 2]
+    assert all(row["task_id"] == 1 for row in rows)
+
+
+def test_deleted_task_notification_has_no_task_id():
+    assert notifications_for(event(DELETED)) == [
+        {"user_id": 2, "message": "Tarea eliminada: Informe", "task_id": None, "traceparent": None},
+    ]
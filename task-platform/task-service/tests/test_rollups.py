@@ -0,0 +1,53 @@
+from collections import Counter
+
+from sqlalchemy.dialects import mysql
+from sqlalchemy.sql.dml import Insert, Update
+
+from models import DEFAULT_STATUS
+from rollups import rollup_move, rollup_statements
+
+
+def compiled(stmt):
+    return stmt.compile(dialect=mysql.dialect())
+
+
+def test_move_between_groups():
+    assert rollup_move((1, 2, "pending"), (1, 3, "pending")) == Counter({(1, 2, "pending"): -1, (1, 3, "pending"): 1})
+
+
+def test_move_onto_the_same_group_cancels_out():
+    deltas = rollup_move((1, 2, "pending"), (1, 2, "pending"))
+    assert +deltas == Counter()
+    assert rollup_statements(deltas) == []
+
+
+def test_increments_are_one_upsert():
+    statements = rollup_statements(Counter({(1, 2, "pending"): 2, (1, 3, "done"): 1}))
+    assert len(statements) == 1
+    assert isinstance(statements[0], Insert)
+    sql = str(compiled(statements[0]))
+    assert "ON DUPLICATE KEY UPDATE" in sql
+    assert compiled(statements[0]).params["count_m0"] == 2
+
+
+def test_decrements_only_update_and_clamp_at_zero():
+    statements = rollup_statements(rollup_move((1, 2, "pending"), (1, 3, "pending")))
+    inserts = [stmt for stmt in statements if isinstance(stmt, Insert)]
+    updates = [stmt for stmt in statements if isinstance(stmt, Update)]
+    assert len(inserts) == len(updates) == 1
+    params = compiled(inserts[0]).params
+    assert (params["assigned_to_m0"], params["count_m0"]) == (3, 1)
+    assert "greatest" in str(compiled(updates[0])).lower()
+    assert compiled(updates[0]).params["assigned_to_1"] == 2
+
+
+def test_null_status_counts_as_default_status():
+    deltas = Counter({(1, 2, None): -1, (1, 2, DEFAULT_STATUS): 1})
+    assert rollup_statements(deltas) == []
+
+
+def test_transitions_only_count_entries():
+    statements = rollup_statements(Counter(), Counter({(1, "done"): 1, (1, "pending"): -1}))
+    assert len(statements) == 1
+    params = compiled(statements[0]).params
+    assert (params["status_m0"], params["count_m0"]) == ("done", 1)